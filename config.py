@@ -3,31 +3,259 @@
 # @Author       : Chris
 # @Description  :
 import _datetime
+import asyncio
 import copy
+import fnmatch
+import functools
 import json
 import os.path
+import pickle
+import re
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 from lxml.etree import _ElementTree as XmlDocument
 from lxml.etree import _Attrib as XmlAttribute
 from lxml.etree import _Element as XmlElement
 from lxml.etree import _Comment as XmlComment
 from string import Template
-from typing import Dict, List, Union
+from typing import Dict, List, Union, Optional, Any, Callable
 import glob
 import yaml
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../config'))
 
 
+class FileCache:
+    """
+    Cache of config file contents and their parsed objects, shared by config readers. An entry is validated by the
+    (mtime_ns, size) of the file, or trusted for 'ttl' seconds. Missing files are cached as well.
+    Objects of 'read_parsed' are shared, callers must not modify them.
+    """
+    def __init__(self, ttl: float = None):
+        """
+        :param ttl: Seconds an entry is trusted without checking the file. None: Check on every read.
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._path2entry: Dict[str, list] = {}  # path: [stamp, checked_at, text, {kind: parsed}]
+        self._lock = threading.Lock()
+
+    def read_text(self, path: str) -> Optional[str]:
+        """
+        Read a utf-8 text file. Returns None if it isn't a file.
+        """
+        return self._get_entry(path)[2]
+
+    def read_json(self, path: str, shared: bool = False) -> Optional[Any]:
+        """
+        Read a JSON file as python object. Returns None if it isn't a file.
+        :param shared: Return the cached object itself instead of a copy. It must be treated as read-only.
+        """
+        obj = self.read_parsed(path, "json", json.loads)
+        return obj if shared else copy.deepcopy(obj)
+
+    def read_parsed(self, path: str, kind: str, parse: Callable[[str], Any]) -> Optional[Any]:
+        """
+        Read a text file parsed by 'parse', the result is cached as 'kind' with the text. Returns None if it isn't
+        a file.
+        """
+        entry = self._get_entry(path)
+        if entry[2] is None:
+            return None
+        kind2parsed = entry[3]
+        if kind not in kind2parsed:
+            kind2parsed[kind] = parse(entry[2])
+        return kind2parsed[kind]
+
+    def is_file(self, path: str) -> bool:
+        return self._get_entry(path)[0] is not None
+
+    def invalidate(self, path: str = None):
+        """
+        Drop the entry of 'path', or all entries if 'path' is None.
+        """
+        with self._lock:
+            if path is None:
+                self._path2entry.clear()
+            else:
+                self._path2entry.pop(path, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._path2entry)}
+
+    def export(self, prefixes: List[str]) -> Dict[str, tuple]:
+        """
+        Picklable entries of the paths starting with any of 'prefixes'. Parsed objects that can't be pickled are left.
+        :return: {path: (stamp, text, {kind: parsed})}
+        """
+        with self._lock:
+            path2entry = {x: y for x, y in self._path2entry.items() if any(x.startswith(z) for z in prefixes)}
+        result = {}
+        for path, (stamp, _, text, kind2parsed) in path2entry.items():
+            picklable = {}
+            for kind, parsed in kind2parsed.items():
+                try:
+                    pickle.dumps(parsed, pickle.HIGHEST_PROTOCOL)
+                except Exception:  # Any error of custom pickling.
+                    continue
+                picklable[kind] = parsed
+            result[path] = (stamp, text, picklable)
+        return result
+
+    def seed(self, path2entry: Dict[str, tuple]) -> int:
+        """
+        Add entries exported by 'export', entries whose file changed are skipped.
+        :return: Count of the added entries.
+        """
+        now = time.monotonic()
+        entries = {path: [stamp, now, text, dict(kind2parsed)]
+                   for path, (stamp, text, kind2parsed) in path2entry.items() if self.stamp(path) == stamp}
+        with self._lock:
+            self._path2entry.update(entries)
+        return len(entries)
+
+    def stamps(self) -> Dict[str, Optional[tuple]]:
+        """
+        Snapshot of the cached paths and the stamps they were read with.
+        """
+        with self._lock:
+            return {path: entry[0] for path, entry in self._path2entry.items()}
+
+    def _get_entry(self, path: str) -> list:
+        now = time.monotonic()
+        entry = self._path2entry.get(path)
+        if entry is not None and self.ttl is not None and now - entry[1] < self.ttl:
+            self.hits += 1
+            return entry
+        stamp = self.stamp(path)
+        if entry is not None and entry[0] == stamp:
+            entry[1] = now
+            self.hits += 1
+            return entry
+        self.misses += 1
+        text = None
+        if stamp is not None:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        entry = [stamp, now, text, {}]
+        with self._lock:
+            self._path2entry[path] = entry
+        return entry
+
+    @staticmethod
+    def stamp(path: str) -> Optional[tuple]:
+        """
+        (mtime_ns, size) of a file, None if it isn't a file.
+        """
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):  # Same as 'os.path.isfile'.
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_mtime_ns, st.st_size
+
+
+FILE_CACHE = FileCache()  # Shared by config readers by default.
+
+
+class TextTemplate:
+    """
+    A text config compiled once. JSON configs are filled by 'string.Template'($name), the others by 'str.format'
+    ({name}). Rendered texts are memoized by the frozen arguments, so new dates or dynamic config just miss. Texts
+    of arguments not known to be immutable aren't memoized.
+    """
+    max_memo_size = 64
+
+    def __init__(self, text: str, is_json: bool):
+        self.text = text
+        self._template = Template(text) if is_json else None
+        self._memo: Dict[Any, str] = {}
+        self._lock = threading.Lock()  # Rendered by reader threads.
+
+    def render(self, kwargs: dict) -> str:
+        """
+        :raise KeyError: If an argument is absent.
+        """
+        try:
+            key = _freeze(kwargs)
+        except TypeError:  # Mutable argument, rendered every time.
+            key = None
+        text = self._memo.get(key) if key is not None else None
+        if text is None:
+            text = self._template.substitute(**kwargs) if self._template is not None else self.text.format(**kwargs)
+            if key is not None:
+                with self._lock:
+                    if len(self._memo) >= self.max_memo_size:
+                        self._memo.pop(next(iter(self._memo)), None)  # Drop the oldest.
+                    self._memo[key] = text
+        return text
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+_IMMUTABLE_TYPES = frozenset((str, int, float, bool, type(None), _datetime.date, _datetime.datetime))
+
+
+def _freeze(obj):
+    """
+    Key of an argument object by value. Types are kept so that e.g. 1, 1.0 and True are different keys.
+    :raise TypeError: If 'obj' contains something not known to be immutable, an object hashed by identity may change
+        its text after being used as a key.
+    """
+    if isinstance(obj, dict):
+        return dict, tuple((k, _freeze(v)) for k, v in obj.items())
+    elif isinstance(obj, list):
+        return list, tuple(_freeze(x) for x in obj)
+    elif type(obj) is tuple:
+        return tuple, tuple(_freeze(x) for x in obj)
+    elif type(obj) is frozenset:
+        return frozenset, frozenset(_freeze(x) for x in obj)
+    elif type(obj) in _IMMUTABLE_TYPES:
+        return type(obj), obj
+    raise TypeError(f"Not an immutable argument of type '{type(obj).__name__}'!")
+
+
+# The libyaml loader if available, it has the same safe semantics as 'yaml.safe_load' and is much faster.
+_YamlSafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _load_yaml(text: str):
+    return yaml.load(text, Loader=_YamlSafeLoader)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_rendered_yaml(text: str):
+    """Parsed rendered yaml texts. The results are shared."""
+    return _load_yaml(text)
+
+
 class SimpleConfig:
-    def __init__(self, offset_path=""):
+    def __init__(self, offset_path="", file_cache: FileCache = None):
         self._root = os.path.abspath(os.path.join(ROOT, offset_path))
+        self.file_cache = file_cache or FILE_CACHE
 
-    def read_yaml(self, rel_path: str):
-        """Read yaml as python object."""
-        with open(f"{self._root}/{rel_path}", "r", encoding="utf8") as f:
-            obj = yaml.safe_load(f)
-        return obj
+    def read_yaml(self, rel_path: str, shared: bool = False):
+        """
+        Read yaml as python object.
+        :param shared: Return the cached object itself instead of a copy. It must be treated as read-only.
+        """
+        path = f"{self._root}/{rel_path}"
+        obj = self.file_cache.read_parsed(path, "yaml", _load_yaml)
+        if obj is None and not self.file_cache.is_file(path):
+            raise FileNotFoundError(f'找不到配置文件 "{path}"。')
+        return obj if shared else copy.deepcopy(obj)
 
     def read_json(self, rel_path: str):
         with open(f"{self._root}/{rel_path}", "r", encoding="utf8") as f:
@@ -35,21 +263,179 @@ class SimpleConfig:
         return obj
 
 
+@functools.lru_cache(maxsize=4)
+def _get_date_side_config(today: _datetime.date) -> tuple:
+    """Date items of global side config, computed once a day."""
+    date_format = "%Y%m%d"
+    return (('yesterday', (today + _datetime.timedelta(days=-1)).strftime(date_format)),
+            ('today', today.strftime(date_format)),
+            ('tomorrow', (today + _datetime.timedelta(days=1)).strftime(date_format)))
+
+
+def _get_side_conf_paths(cascade_paths: List[str]) -> List[str]:
+    """Side config paths of a cascade, base of the lowest priority first."""
+    return [y
+            for x in reversed(cascade_paths)
+            for y in [f'{os.path.dirname(x)}/common.json', f'{x}.json']]
+
+
+class CascadeIndex:
+    """
+    In-memory index of the files under 'root/<site>' of all sites, scanned once. Path lookups of a cascade config are
+    answered from the index instead of probing the disk.
+    The index is updated by 'refresh', or by 'poll' which rescans the directories whose mtime changed.
+    """
+    def __init__(self, root: str, site_seq: List[str], poll_interval: float = None):
+        """
+        :param root: Root directory of the sites.
+        :param site_seq: Sites from the highest priority to the lowest priority.
+        :param poll_interval: Seconds between automatic polls on lookup. None: Only update on 'refresh' or 'poll'.
+        """
+        self.root = root
+        self.site_seq = list(site_seq)
+        self.poll_interval = poll_interval
+        self._site_roots = [os.path.normpath(f'{root}/{x}') for x in self.site_seq]
+        self._dir2listing: Dict[str, tuple] = {}  # abs_dir: (mtime_ns, [name])
+        self._paths = set()  # Abs paths of indexed files and directories.
+        self._rel_path2resolved: Dict[str, tuple] = {}
+        self._polled_at = 0.
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def refresh(self):
+        """Rescan all sites."""
+        with self._lock:
+            self._dir2listing.clear()
+            self._paths.clear()
+            self._rel_path2resolved.clear()
+            for site_root in self._site_roots:
+                if os.path.isdir(site_root):
+                    self._paths.add(site_root)
+                    self._scan_dir(site_root)
+            self._polled_at = time.monotonic()
+
+    def poll(self) -> bool:
+        """
+        Rescan the directories changed since the last scan.
+        :return: Whether anything changed.
+        """
+        with self._lock:
+            changed = False
+            for site_root in self._site_roots:
+                if (site_root in self._paths) != os.path.isdir(site_root):  # Site created or removed.
+                    self.refresh()
+                    return True
+            for abs_dir, (mtime_ns, _) in list(self._dir2listing.items()):
+                if abs_dir not in self._dir2listing:  # Dropped within this poll.
+                    continue
+                try:
+                    changed_dir = os.stat(abs_dir).st_mtime_ns != mtime_ns
+                except OSError:
+                    changed_dir = True
+                if changed_dir:
+                    self._drop_dir(abs_dir)
+                    if os.path.isdir(abs_dir):
+                        self._scan_dir(abs_dir)
+                    changed = True
+            if changed:
+                self._rel_path2resolved.clear()
+            self._polled_at = time.monotonic()
+            return changed
+
+    def exists(self, path: str) -> bool:
+        """'os.path.exists' of a path. Paths outside of the sites are checked on disk."""
+        norm_path = os.path.normpath(path)
+        if not self._is_indexed(norm_path):
+            return os.path.exists(path)
+        self._auto_poll()
+        return norm_path in self._paths
+
+    def listdir(self, path: str) -> List[str]:
+        """'glob.glob1(path, "*")' like listing, hidden files are included. Empty if 'path' isn't a directory."""
+        norm_path = os.path.normpath(path)
+        if not self._is_indexed(norm_path):
+            return os.listdir(path) if os.path.isdir(path) else []
+        self._auto_poll()
+        listing = self._dir2listing.get(norm_path)
+        return list(listing[1]) if listing is not None else []
+
+    def resolve(self, rel_path: str) -> tuple:
+        """
+        Existing paths of a relative config path.
+        :return: (cascade paths from the highest priority to the lowest, side config paths of the lowest priority
+            first).
+        """
+        self._auto_poll()
+        resolved = self._rel_path2resolved.get(rel_path)
+        if resolved is None:
+            cascade_paths = [f'{self.root}/{x}/{rel_path}' for x in self.site_seq]
+            resolved = ([x for x in cascade_paths if self.exists(x)],
+                        [x for x in _get_side_conf_paths(cascade_paths) if self.exists(x)])
+            self._rel_path2resolved[rel_path] = resolved
+        return resolved
+
+    def _auto_poll(self):
+        if self.poll_interval is not None and time.monotonic() - self._polled_at >= self.poll_interval:
+            self.poll()
+
+    def _is_indexed(self, norm_path: str) -> bool:
+        return any(norm_path == x or norm_path.startswith(x + os.sep) for x in self._site_roots)
+
+    def _scan_dir(self, abs_dir: str):
+        try:
+            mtime_ns = os.stat(abs_dir).st_mtime_ns
+            names = os.listdir(abs_dir)
+        except OSError:
+            return
+        self._dir2listing[abs_dir] = (mtime_ns, names)
+        for name in names:
+            path = os.path.join(abs_dir, name)
+            self._paths.add(path)
+            if os.path.isdir(path):
+                self._scan_dir(path)
+
+    def _drop_dir(self, abs_dir: str):
+        listing = self._dir2listing.pop(abs_dir, None)
+        if listing is None:
+            return
+        for name in listing[1]:
+            path = os.path.join(abs_dir, name)
+            self._paths.discard(path)
+            self._drop_dir(path)
+
+
 class CascadeConfig:
     """
     层叠配置。设计目标是减少配置冗余。
     """
-    def __init__(self, site_id: str, bases: List[str] = ("default",)):
+    def __init__(self, site_id: str, bases: List[str] = ("default",), file_cache: FileCache = None,
+                 indexed: bool = False, index_poll_interval: float = None):
         """
         :param site_id: Top level folder name of the set of config files under 'root'.
         :param bases: Base sites of this config site.
             The first base site has the highest priority when cascading.
             The lower the second one and so on.
+        :param file_cache: Cache of file reads. The shared 'FILE_CACHE' by default.
+        :param indexed: Resolve config paths by a 'CascadeIndex' of all sites, scanned on first use.
+        :param index_poll_interval: See 'CascadeIndex'.
         """
         self.root = ROOT
         self.site_id = site_id
         self._site_seq = [site_id, *bases]  # The highest priority to the lowest priority.
         self._dynamic_config = {}
+        self.file_cache = file_cache or FILE_CACHE
+        self.indexed = indexed
+        self.index_poll_interval = index_poll_interval
+        self._index: Optional[CascadeIndex] = None
+
+    @property
+    def index(self) -> Optional[CascadeIndex]:
+        """The index of config files, None if not 'indexed'. Rebuilt when 'root' changes."""
+        if not self.indexed:
+            return None
+        if self._index is None or self._index.root != self.root:
+            self._index = CascadeIndex(self.root, self._site_seq, self.index_poll_interval)
+        return self._index
 
     def read_text(self, rel_path: str, **top_side_conf) -> str:
         """
@@ -59,37 +445,37 @@ class CascadeConfig:
         :param rel_path: The relative path of config file. e.g: sqls/abc.sql
         :return: The built config string.
         """
+        return self._read_text(rel_path, top_side_conf, self._get_global_side_config_dict(),
+                               functools.partial(self.file_cache.read_json, shared=True))
+
+    def _read_text(self, rel_path: str, top_side_conf: dict, global_side_conf: dict,
+                   read_side_conf: Callable[[str], Optional[dict]]) -> str:
         # 1. Read Cascaded side config.
-        cascade_paths = self._get_cascade_paths(rel_path)
-        side_conf_paths = [y
-                           for x in reversed(cascade_paths)  # Base of the lowest priority first.
-                           for y in [f'{os.path.dirname(x)}/common.json', f'{x}.json']]
-        kwargs = self._get_global_side_config_dict()
+        index = self.index
+        if index is not None:
+            cascade_paths, side_conf_paths = index.resolve(rel_path)  # Existing paths only.
+        else:
+            cascade_paths = self._get_cascade_paths(rel_path)
+            side_conf_paths = _get_side_conf_paths(cascade_paths)  # Base of the lowest priority first.
+        kwargs = dict(global_side_conf)
         for path in side_conf_paths:
-            if not os.path.isfile(path):
-                continue
-            with open(path, 'r', encoding='utf-8') as f:
-                conf_dict = json.load(f)
+            conf_dict = read_side_conf(path)
+            if conf_dict is not None:
                 kwargs.update(conf_dict)
         kwargs.update(self._dynamic_config)
         kwargs.update(top_side_conf)  # Top side config has the highest priority.
         # 2. Load master text config file.
-        conf_text = None
+        template = None
+        is_json = rel_path.endswith(".json")  # There's something special required to do for json plain config.
         for path in cascade_paths:  # Exclusive first.
-            if not os.path.isfile(path):
-                continue
-            with open(path, 'r', encoding='utf-8') as f:
-                conf_text = f.read()
+            template = self.file_cache.read_parsed(path, "template", lambda text: TextTemplate(text, is_json))
+            if template is not None:
                 break
-        if conf_text is None:
+        if template is None:
             raise FileNotFoundError(f'找不到配置 {self.root}/{"|".join(self._site_seq)}/{rel_path}')
         # 3. Fill master config text with side config parameters.
         try:
-            if rel_path.endswith(".json"):  # There's something special required to do for json plain config.
-                conf_text = Template(conf_text).substitute(**kwargs)
-            else:
-                conf_text = conf_text.format(**kwargs)
-            return conf_text
+            return template.render(kwargs)
         except KeyError as ke:
             args_str = str.join(', ', ke.args)
             raise KeyError(f'读取配置 "{rel_path}" 时出错, 缺少参数 "{args_str}"！')
@@ -107,41 +493,82 @@ class CascadeConfig:
         obj = json.loads(str_json)
         return obj
 
-    def read_json_fortified(self, rel_path: str) -> dict:
+    def read_many(self, rel_paths: List[str], workers: int = 0, **top_side_conf) -> Dict[str, Any]:
+        """
+        Read many configs at once. The global side config is computed once and each side config file is read once.
+        Configs are read by extension: '.json' by 'read_json', '.yml'/'.yaml' by 'read_yaml', '.xml' by 'read_xml',
+        the others by 'read_text'.
+        :param rel_paths:
+        :param workers: Count of threads reading configs in parallel. 0: Read in the current thread.
+        :param top_side_conf: Top side config of all text configs.
+        :return: {rel_path: config}
+        """
+        global_side_conf = self._get_global_side_config_dict()
+        path2side_conf = {}
+        lock = threading.Lock()
+
+        def read_side_conf(path: str) -> Optional[dict]:
+            with lock:  # Read once by worker threads.
+                if path not in path2side_conf:
+                    path2side_conf[path] = self.file_cache.read_json(path, shared=True)
+                return path2side_conf[path]
+
+        def read(rel_path: str):
+            if rel_path.endswith(".xml"):
+                return self.read_xml(rel_path)
+            text = self._read_text(rel_path, top_side_conf, global_side_conf, read_side_conf)
+            if rel_path.endswith(".json"):
+                return json.loads(text)
+            elif rel_path.endswith((".yml", ".yaml")):
+                return copy.deepcopy(_load_rendered_yaml(text))
+            return text
+
+        rel_paths = list(dict.fromkeys(rel_paths))
+        if workers > 0:
+            with ThreadPoolExecutor(workers) as executor:
+                return dict(zip(rel_paths, executor.map(read, rel_paths)))
+        return {x: read(x) for x in rel_paths}
+
+    def read_json_fortified(self, rel_path: str, shared: bool = False) -> dict:
         """
         Strong cascading. The cascaded config dicts will be stacked from bottom to top.
         :param rel_path:
+        :param shared: Return the values cached with the files instead of copies. They must be treated as read-only.
         :return:
         """
-        cascade_paths = self._get_cascade_paths(rel_path)
+        index = self.index
+        cascade_paths = index.resolve(rel_path)[0] if index is not None else self._get_cascade_paths(rel_path)
         result = {}
         for path in reversed(cascade_paths):
-            if not os.path.isfile(path):
-                continue
-            with open(path, 'r', encoding='utf-8') as f:
-                json_dict = json.load(f)
+            json_dict = self.file_cache.read_json(path, shared=True)
+            if json_dict is not None:
                 result.update(json_dict)
-        return result
+        return result if shared else copy.deepcopy(result)
 
     def write_json(self, obj, rel_path):
         path = self.detect_abs_path(rel_path)
         with open(path, 'w', encoding='utf-8') as f:
             json.dump(obj, f, ensure_ascii=False, indent='\t')
+        self.file_cache.invalidate(path)
 
-    def read_xml(self, rel_path: str) -> XmlDocument:
+    def read_xml(self, rel_path: str, shared: bool = False) -> XmlDocument:
+        """
+        :param shared: See 'XmlConfig.load'.
+        """
         xml_conf = XmlConfig(self)
-        return xml_conf.load(rel_path)
+        return xml_conf.load(rel_path, shared)
 
-    def read_yaml(self, rel_path: str) -> Union[dict, list]:
+    def read_yaml(self, rel_path: str, shared: bool = False) -> Union[dict, list]:
         """
         Read yaml text file and fill the text with named arguments provided by this config. Then serialize the \
         formatted text as python object.
         :param rel_path:
+        :param shared: Return the cached object itself instead of a copy. It must be treated as read-only.
         :return:
         """
         str_yml = self.read_text(rel_path)
-        obj = yaml.safe_load(str_yml)
-        return obj
+        obj = _load_rendered_yaml(str_yml)
+        return obj if shared else copy.deepcopy(obj)
 
     def format(self, tpl_string: str, **kwargs) -> str:
         """
@@ -154,10 +581,66 @@ class CascadeConfig:
         kwargs.update(self._dynamic_config)
         return Template(tpl_string).substitute(**kwargs)
 
+    def freeze(self, snapshot_path: str):
+        """
+        Read all config files of the sites and write the cached contents to a snapshot file, which is loaded by
+        'load_snapshot' to skip reading, parsing and compiling at startup. Included are raw texts, parsed JSON,
+        templates with their rendered texts, and compiled XML.
+        """
+        site_roots = [os.path.normpath(f'{self.root}/{x}') for x in self._site_seq]
+        rel_paths = set()
+        for site_root in site_roots:
+            for dir_path, _, file_names in os.walk(site_root):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    rel_paths.add(os.path.relpath(path, site_root).replace(os.sep, '/'))
+                    try:
+                        self.file_cache.read_text(path)
+                        if file_name.endswith('.json'):
+                            self.file_cache.read_json(path, shared=True)
+                    except ValueError:  # Not a utf-8 text or JSON file.
+                        pass
+        for rel_path in sorted(rel_paths):
+            try:
+                if rel_path.endswith('.xml'):
+                    self.read_xml(rel_path, shared=True)
+                else:
+                    self.read_text(rel_path)
+            except Exception:  # Such as parameters only provided by callers. The raw files are still frozen.
+                pass
+        snapshot = {
+            "root": self.root,
+            "site_seq": list(self._site_seq),
+            "files": self.file_cache.export([x + os.sep for x in site_roots]),
+            "xml": XmlConfig.export(self.root, self._site_seq),
+        }
+        tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)  # Readers never see a partial snapshot.
+
+    def load_snapshot(self, snapshot_path: str) -> int:
+        """
+        Seed the caches with a snapshot written by 'freeze'. Entries of changed files are skipped, so the snapshot
+        may be stale. A snapshot of other sites is ignored.
+        :return: Count of the loaded entries.
+        """
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot["root"] != self.root or snapshot["site_seq"] != list(self._site_seq):
+            return 0
+        return self.file_cache.seed(snapshot["files"]) + XmlConfig.seed(snapshot["xml"])
+
     def list_dir(self, rel_dir: str, pattern="*") -> List[str]:
         """List files inside the given directory. Return list of relative file paths."""
         abs_dir = self.detect_abs_path(rel_dir)
-        return [f"{rel_dir}/{x}" for x in glob.glob1(abs_dir, pattern)]
+        index = self.index
+        if index is None:
+            return [f"{rel_dir}/{x}" for x in glob.glob1(abs_dir, pattern)]
+        names = index.listdir(abs_dir)
+        if not pattern.startswith('.'):  # Same as 'glob.glob1'.
+            names = [x for x in names if not x.startswith('.')]
+        return [f"{rel_dir}/{x}" for x in fnmatch.filter(names, pattern)]
 
     def detect_abs_path(self, rel_path: str) -> str:
         """
@@ -165,10 +648,15 @@ class CascadeConfig:
         :param rel_path:
         :return: Absolute path of hit config file.
         """
-        paths = self._get_cascade_paths(rel_path)
-        for path in reversed(paths):
-            if os.path.exists(path):
-                return path
+        index = self.index
+        if index is not None:
+            paths = index.resolve(rel_path)[0]
+            if paths:
+                return paths[-1]
+        else:
+            for path in reversed(self._get_cascade_paths(rel_path)):
+                if os.path.exists(path):
+                    return path
         raise FileNotFoundError(f'找不到配置文件或目录 "{self.root}/{"|".join(self._site_seq)}/{rel_path}"。')
 
     def _get_cascade_paths(self, rel_path: str):
@@ -180,13 +668,8 @@ class CascadeConfig:
         Global side config。The config items are usually dynamic, such as date and time.
         :return: A newly created dict with config items.
         """
-        sc_dict = {}
         # 日期
-        today = _datetime.date.today()
-        date_format = "%Y%m%d"
-        sc_dict['yesterday'] = (today + _datetime.timedelta(days=-1)).strftime(date_format)
-        sc_dict['today'] = today.strftime(date_format)
-        sc_dict['tomorrow'] = (today + _datetime.timedelta(days=1)).strftime(date_format)
+        sc_dict = dict(_get_date_side_config(_datetime.date.today()))
         # site_id
         sc_dict['site_id'] = self.site_id
         # Environment variables.
@@ -203,17 +686,79 @@ class CascadeConfig:
         self._dynamic_config[key] = value
 
 
+@functools.lru_cache(maxsize=1024)
+def _compile_xpath(xpath: str) -> etree.XPath:
+    return etree.XPath(xpath)
+
+
+# Id-style selector answered by index, e.g. //item[@id='a'], //*[@name="b"].
+_ID_SELECTOR_PATTERN = re.compile(r"""^//(\*|[A-Za-z_][\w.-]*)\[@([A-Za-z_][\w.-]*)=(?:'([^']*)'|"([^"]*)")]$""")
+
+
 class XmlConfig:
-    def __init__(self, parent: CascadeConfig):
+    # Compiled documents shared by loads. (root, site_seq, rel_wd, abs_path): [stamp, [(rel_path, abs_path, doc)], doc]
+    # An entry is valid while its file is unchanged and its imports resolve to the same valid documents, so only
+    # changed files and their dependents are recompiled.
+    _key2compiled: Dict[tuple, list] = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, parent: CascadeConfig, cached: bool = True):
+        """
+        :param parent:
+        :param cached: Reuse compiled documents of previous loads.
+        """
         self.parent = parent
+        self.cached = cached
+        self._doc2index: Dict[int, tuple] = {}  # id(doc): (doc, {(tag, attr): {value: [element]}})
 
-    def load(self, rel_path: str) -> XmlDocument:
+    def load(self, rel_path: str, shared: bool = False) -> XmlDocument:
+        """
+        :param rel_path:
+        :param shared: Return the cached document itself instead of a copy. It must be treated as read-only.
+        """
         doc: XmlDocument = self._r_compile(os.path.dirname(rel_path), os.path.basename(rel_path), {}, set())
         root: XmlElement = doc.getroot()
         for c in list(root.iterchildren("import")):  # Remove imports.
             root.remove(c)
+        if self.cached and not shared:
+            doc = copy.deepcopy(doc)
         return doc
 
+    @classmethod
+    def invalidate(cls):
+        """Drop all compiled documents."""
+        with cls._cache_lock:
+            cls._key2compiled.clear()
+
+    @classmethod
+    def export(cls, root: str, site_seq: List[str]) -> Dict[tuple, tuple]:
+        """
+        Picklable compiled documents of the sites.
+        :return: {key: (stamp, [(rel_path, import_key)], xml_bytes)}
+        """
+        site_seq = tuple(site_seq)
+        with cls._cache_lock:
+            key2compiled = {x: y for x, y in cls._key2compiled.items() if x[:2] == (root, site_seq)}
+        result = {}
+        for key, (stamp, imported, doc) in key2compiled.items():
+            result[key] = (stamp, [(x, (*key[:3], y)) for x, y, _ in imported], etree.tostring(doc))
+        return result
+
+    @classmethod
+    def seed(cls, key2compiled: Dict[tuple, tuple]) -> int:
+        """
+        Add compiled documents exported by 'export'. They are validated on use like the compiled ones.
+        :return: Count of the added documents.
+        """
+        key2doc = {x: etree.ElementTree(etree.fromstring(y[2])) for x, y in key2compiled.items()}
+        entries = {}
+        for key, (stamp, imported, _) in key2compiled.items():
+            if all(x in key2doc for _, x in imported):  # Otherwise never valid.
+                entries[key] = [stamp, [(x, y[3], key2doc[y]) for x, y in imported], key2doc[key]]
+        with cls._cache_lock:
+            cls._key2compiled.update(entries)
+        return len(entries)
+
     def abspath(self, rel_working_dir: str, rel_file_path: str):
         rel_path = f"{rel_working_dir}/{rel_file_path}" if rel_working_dir.strip() else rel_file_path
         abs_path = f"{self.parent.root}/{rel_path}" if rel_path.startswith("/") \
@@ -223,6 +768,14 @@ class XmlConfig:
     def _r_compile(self, rel_wd: str, rel_fp: str, path2doc: Dict[str, XmlDocument], ref_set: set) -> XmlDocument:
         # 1 Load file.
         abs_path = self.abspath(rel_wd, rel_fp)
+        key = (self.parent.root, tuple(self.parent._site_seq), rel_wd, abs_path)
+        if self.cached:
+            compiled = self._key2compiled.get(key)
+            if compiled is not None and self._is_valid(compiled, rel_wd, abs_path, path2doc, ref_set):
+                path2doc[abs_path] = compiled[2]
+                return compiled[2]
+        stamp = FileCache.stamp(abs_path)
+        imported = []
         xml_doc: XmlDocument = etree.parse(abs_path)
         root: XmlElement = xml_doc.getroot()
         ref_set.add(abs_path)
@@ -239,14 +792,35 @@ class XmlConfig:
                 raise KeyError("Import-as name is conflict with built-in keyword 'self'!")
             imports[as_] = path2doc.get(import_abs_path) or \
                            self._r_compile(rel_wd, import_rel_path, path2doc, ref_set)
+            imported.append((import_rel_path, import_abs_path, imports[as_]))
         for import_ele in list(root.iterchildren("import")):
             root.remove(import_ele)
         # 3 Compile elements.
         self._r_compile_node(root, imports)
         path2doc[abs_path] = xml_doc
         ref_set.remove(abs_path)
+        if self.cached:
+            with self._cache_lock:
+                self._key2compiled[key] = [stamp, imported, xml_doc]
         return xml_doc
 
+    def _is_valid(self, compiled: list, rel_wd: str, abs_path: str, path2doc: Dict[str, XmlDocument],
+                  ref_set: set) -> bool:
+        stamp, imported, _ = compiled
+        if FileCache.stamp(abs_path) != stamp:
+            return False
+        ref_set.add(abs_path)
+        try:
+            for import_rel_path, import_abs_path, import_doc in imported:
+                if self.abspath(rel_wd, import_rel_path) != import_abs_path or import_abs_path in ref_set:
+                    return False  # Resolved to another file, or a circular reference to be reported by compiling.
+                doc = path2doc.get(import_abs_path) or self._r_compile(rel_wd, import_rel_path, path2doc, ref_set)
+                if doc is not import_doc:  # Recompiled.
+                    return False
+        finally:
+            ref_set.remove(abs_path)
+        return True
+
     def _r_compile_node(self, node: XmlElement, imports: Dict[str, XmlDocument]):
         org_children = list(node.iterchildren())
         # 1 Inherit.
@@ -256,7 +830,7 @@ class XmlConfig:
             doc_import: XmlDocument = imports.get(doc_name)
             if doc_import is None:
                 raise Exception(f"XML: Document named '{doc_name}' not imported!")
-            supers = doc_import.xpath(xpath)
+            supers = self._select(doc_import, xpath) if doc_name != "self" else _compile_xpath(xpath)(doc_import)
             if len(supers) == 0:
                 raise Exception(f"XML: Unable to inherit. Element at '{extends}' not found!")
             elif len(supers) > 1:
@@ -276,7 +850,7 @@ class XmlConfig:
         # 2 Override.
         override: str = node.get("_override_")
         if override is not None:
-            members: list = node.getparent().xpath(override)
+            members: list = _compile_xpath(override)(node.getparent())
             if node in members:
                 members.remove(node)
             if len(members) == 0:
@@ -291,6 +865,200 @@ class XmlConfig:
         for child in org_children:
             self._r_compile_node(child, imports)
 
+    def _select(self, doc: XmlDocument, xpath: str) -> list:
+        """
+        Evaluate 'xpath' on a compiled document. Id-style selectors are answered by an index of the document built on
+        first use, the document must not be modified afterwards.
+        """
+        match = _ID_SELECTOR_PATTERN.match(xpath)
+        if match is None:
+            return _compile_xpath(xpath)(doc)
+        tag, attr, value1, value2 = match.groups()
+        index = self._doc2index.get(id(doc))
+        if index is None:
+            index = self._doc2index[id(doc)] = (doc, {})  # Keep 'doc' alive so that its id isn't reused.
+        value2elements = index[1].get((tag, attr))
+        if value2elements is None:
+            value2elements = index[1][(tag, attr)] = {}
+            for ele in doc.getroot().iter(etree.Element if tag == "*" else tag):  # Document order.
+                value = ele.get(attr)
+                if value is not None:
+                    value2elements.setdefault(value, []).append(ele)
+        return list(value2elements.get(value1 if value1 is not None else value2, ()))
+
     @staticmethod
     def desc(ele: XmlElement) -> str:
         return str(etree.tostring(ele, encoding="utf-8", pretty_print=True), encoding="utf-8")
+
+
+class ConfigWatcher:
+    """
+    Hot reloading of a 'CascadeConfig'. Polls the stamps of the cached files of the config sites and of the
+    subscribed config files, drops the changed ones from the file cache, and calls the subscribers of the affected
+    relative paths. A change of 'common.json' affects every config in its directory, a change of 'x.json' affects
+    'x' and 'x.json'.
+    Pair it with a 'FileCache' having a long 'ttl' to read from memory and still pick up changes.
+    """
+    def __init__(self, config: CascadeConfig, interval: float = 1.):
+        """
+        :param config: The watched config.
+        :param interval: Seconds between polls of the background thread.
+        """
+        self.config = config
+        self.interval = interval
+        self.last_error: Optional[Exception] = None
+        self._rel_path2callbacks: Dict[str, List[Callable[[str], Any]]] = {}
+        self._path2stamp: Dict[str, Optional[tuple]] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, rel_path: str, callback: Callable[[str], Any]):
+        """
+        Call 'callback(rel_path)' when the config of 'rel_path' changes.
+        """
+        with self._lock:
+            self._rel_path2callbacks.setdefault(rel_path, []).append(callback)
+            for path in self._get_watched_paths(rel_path):  # Watch files not read yet.
+                self._path2stamp.setdefault(path, FileCache.stamp(path))
+
+    def unsubscribe(self, rel_path: str, callback: Callable[[str], Any]):
+        with self._lock:
+            callbacks = self._rel_path2callbacks.get(rel_path, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._rel_path2callbacks.pop(rel_path, None)
+
+    def check(self) -> List[str]:
+        """
+        Poll once.
+        :return: Changed relative paths, sorted.
+        """
+        with self._lock:
+            file_cache = self.config.file_cache
+            site_roots = {x: os.path.normpath(f'{self.config.root}/{x}') + os.sep for x in self.config._site_seq}
+            for path, stamp in file_cache.stamps().items():
+                if any(path.startswith(x) for x in site_roots.values()):
+                    # Only a path seen first takes the cache's stamp, a read may have refreshed a changed file since.
+                    self._path2stamp.setdefault(path, stamp)
+            changed_rel_paths = set()
+            for path, stamp in self._path2stamp.items():
+                new_stamp = FileCache.stamp(path)
+                if new_stamp == stamp:
+                    continue
+                file_cache.invalidate(path)
+                self._path2stamp[path] = new_stamp
+                norm_path = os.path.normpath(path)
+                for site_root in site_roots.values():
+                    if norm_path.startswith(site_root):
+                        changed_rel_paths.add(norm_path[len(site_root):].replace(os.sep, '/'))
+                        break
+            if not changed_rel_paths:
+                return []
+            index = self.config.index
+            if index is not None:
+                index.poll()
+            calls = []
+            for rel_path, callbacks in self._rel_path2callbacks.items():
+                if any(self._is_affected(rel_path, x) for x in changed_rel_paths):
+                    calls.extend((x, rel_path) for x in callbacks)
+        for callback, rel_path in calls:  # Out of lock, callbacks may read the config or subscribe.
+            callback(rel_path)
+        return sorted(changed_rel_paths)
+
+    def start(self) -> 'ConfigWatcher':
+        """Poll in a daemon thread."""
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="ConfigWatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'ConfigWatcher':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:  # Keep watching.
+                self.last_error = e
+
+    def _get_watched_paths(self, rel_path: str) -> List[str]:
+        cascade_paths = self.config._get_cascade_paths(rel_path)
+        return cascade_paths + _get_side_conf_paths(cascade_paths)
+
+    @staticmethod
+    def _is_affected(rel_path: str, changed_rel_path: str) -> bool:
+        if changed_rel_path in (rel_path, f'{rel_path}.json'):
+            return True
+        return os.path.basename(changed_rel_path) == 'common.json' and \
+            os.path.dirname(changed_rel_path) == os.path.dirname(rel_path)
+
+
+class AsyncCascadeConfig:
+    """
+    Asyncio facade of a 'CascadeConfig'. Reads run on a bounded thread pool sharing the caches of the config, and
+    concurrent reads of the same config are coalesced into one load. Each caller gets its own copy of a result.
+    """
+    def __init__(self, config: CascadeConfig, max_workers: int = 4):
+        """
+        :param config: The config read by worker threads.
+        :param max_workers: Max count of concurrent loads.
+        """
+        self.config = config
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="AsyncCascadeConfig")
+        self._key2future: Dict[tuple, asyncio.Future] = {}
+
+    async def read_text(self, rel_path: str, **top_side_conf) -> str:
+        return await self._run("read_text", rel_path, top_side_conf)
+
+    async def read_json(self, rel_path: str) -> Union[dict, list]:
+        return await self._run("read_json", rel_path, {})
+
+    async def read_json_fortified(self, rel_path: str) -> dict:
+        return await self._run("read_json_fortified", rel_path, {"shared": True})
+
+    async def read_yaml(self, rel_path: str) -> Union[dict, list]:
+        return await self._run("read_yaml", rel_path, {"shared": True})
+
+    async def read_xml(self, rel_path: str) -> XmlDocument:
+        return await self._run("read_xml", rel_path, {"shared": True})
+
+    def close(self):
+        """Wait for loads in progress and release the threads. Blocking, use 'aclose' in coroutines."""
+        self._executor.shutdown(wait=True)
+
+    async def aclose(self):
+        """Like 'close', without blocking the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self) -> 'AsyncCascadeConfig':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def _run(self, method: str, rel_path: str, kwargs: dict):
+        load = functools.partial(getattr(self.config, method), rel_path, **kwargs)
+        loop = asyncio.get_running_loop()
+        try:
+            key = (id(loop), method, rel_path, _freeze(kwargs))
+        except TypeError:  # Mutable argument, not coalesced.
+            return await loop.run_in_executor(self._executor, load)
+        future = self._key2future.get(key)
+        if future is None:
+            future = self._key2future[key] = loop.run_in_executor(self._executor, load)
+            future.add_done_callback(lambda _: self._key2future.pop(key, None))
+        result = await asyncio.shield(future)  # A cancelled caller doesn't cancel the others.
+        return result if isinstance(result, str) else copy.deepcopy(result)
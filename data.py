@@ -3,11 +3,19 @@
 # @Author       : Chris
 # @Description  :
 import base64
+import collections
 import json
+import mmap
 import os.path
+import shutil
+import struct
+import threading
+import time
 import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union, List, Tuple
+from typing import Union, List, Tuple, BinaryIO, Iterator, Optional, IO, Callable, Dict
 from copy import deepcopy
 import io
 import zipfile
@@ -15,118 +23,667 @@ from PIL import Image
 from .path import realpath
 
 
-def zip_coco2bytes(coco_data: Union[dict, str]) -> bytes:
-    """Zip COCO to bytes. Images are packed too."""
+_CHUNK_SIZE = 1 << 20
+# Payloads barely shrinking by deflating, stored as is by the "auto" compression.
+_STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp4", ".avi", ".mkv", ".mp3",
+                      ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar", ".npz"}
+_SAMPLE_SIZE = 1 << 16
+_PARALLEL_MAX_SIZE = 16 << 20  # Larger files are compressed in chunks by the writer thread, not held in memory.
+_STORE_RATIO = 0.9  # Deflated sample size / sample size, above which an entry is stored by "auto".
+
+
+def zip_coco2bytes(coco_data: Union[dict, str], compression: str = "deflate", workers: int = 0) -> bytes:
+    """Zip COCO to bytes. Images are packed too. See 'zip_coco2stream' for the arguments."""
+    with io.BytesIO() as buffer:
+        zip_coco2stream(coco_data, buffer, compression, workers)
+        return buffer.getvalue()
+
+
+def zip_coco2stream(coco_data: Union[dict, str], stream: BinaryIO, compression: str = "deflate", workers: int = 0):
+    """
+    Zip COCO into a writable binary stream, such as a file, a socket file or an HTTP response. The stream needn't be
+    seekable. Images are packed too, copied in chunks so memory doesn't grow with the dataset.
+    :param compression: Compression of entries.
+        1. "deflate": Deflate all.
+        2. "store": Store all as is.
+        3. "auto": Store already compressed payloads, by the file extension or a sampled compression ratio. Deflate
+            the others.
+    :param workers: Count of threads compressing entries concurrently, then the entries are written in order.
+        Each entry in progress is held in memory, files over 16 MiB are compressed in chunks by the writing thread
+        instead. 0: Compress in the current thread.
+    """
+    _zip2stream(_get_coco_entries(coco_data), stream, compression, workers)
+
+
+def iter_zip_coco(coco_data: Union[dict, str], chunk_size: int = _CHUNK_SIZE, compression: str = "deflate",
+                  workers: int = 0) -> Iterator[bytes]:
+    """Zip COCO as chunks of bytes of about 'chunk_size'. See 'zip_coco2stream'."""
+    return _iter_zip_chunks(_get_coco_entries(coco_data), chunk_size, compression, workers)
+
+
+def _get_coco_entries(coco_data: Union[dict, str]) -> Iterator[tuple]:
     if isinstance(coco_data, dict):  # In memory coco dict.
-        with io.BytesIO() as buffer:
-            with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED, False) as zf:
-                images = []
-                for img_dict in coco_data["images"]:
-                    img_dict_copy = deepcopy(img_dict)
-                    raw_img_path = img_dict_copy["file_name"]
-                    img_path = realpath(raw_img_path)
-                    file_name = os.path.basename(img_path)
-                    new_img_path = f"images/{file_name}"
-                    zf.write(img_path, new_img_path)
-                    img_dict_copy["file_name"] = file_name
-                    images.append(img_dict_copy)
-                org_images = coco_data["images"]
-                coco_data["images"] = images  # Make new data for zipping.
-                zf.writestr("annotations.json", json.dumps(coco_data, ensure_ascii=True))
-                coco_data["images"] = org_images  # Recover original data.
-            return buffer.getvalue()
+        return _iter_coco_entries(coco_data)
     elif isinstance(coco_data, str):
         with open(coco_data, "r", encoding="utf-8") as f:
             coco_dict = json.load(f)
-        return zip_coco2bytes(coco_dict)
+        return _get_coco_entries(coco_dict)
     else:
         raise NotImplementedError(f"Unsupported coco data type '{coco_data}'!")
 
 
-def zip_data2bytes(data: List[Union[str, dict, Image.Image]]):
+def _iter_coco_entries(coco_data: dict) -> Iterator[tuple]:
+    """Entries of a zip, (arcname, file_path, data), either 'file_path' or 'data' is None."""
+    images = []
+    for img_dict in coco_data["images"]:
+        img_dict_copy = deepcopy(img_dict)
+        raw_img_path = img_dict_copy["file_name"]
+        img_path = realpath(raw_img_path)
+        file_name = os.path.basename(img_path)
+        new_img_path = f"images/{file_name}"
+        yield new_img_path, img_path, None
+        img_dict_copy["file_name"] = file_name
+        images.append(img_dict_copy)
+    zipped_coco_data = dict(coco_data, images=images)  # Make new data for zipping.
+    yield "annotations.json", None, json.dumps(zipped_coco_data, ensure_ascii=True).encode("utf-8")
+
+
+def zip_coco2stream_incremental(coco_data: Union[dict, str], base_zip: Union[str, bytes, memoryview, BinaryIO],
+                               stream: BinaryIO, compression: str = "deflate", workers: int = 0,
+                               compare: str = "stat") -> Dict[str, int]:
+    """
+    Zip COCO like 'zip_coco2stream', reusing the images of a previous archive of it. Unchanged images are copied from
+    'base_zip' as compressed, the others are added. Images not in 'coco_data' are dropped, 'annotations.json' is
+    always written.
+    :param base_zip: The previous archive, any source of 'ZipReader'. It must not be 'stream'.
+    :param compare: How an image is compared with its entry of the same name.
+        1. "stat": By file size and modified time.
+        2. "crc": By file size and CRC-32 of the content, reading files but not compressing them.
+    :return: {"copied": Count of copied images, "added": Count of added images}
+    """
+    if compare not in ("stat", "crc"):
+        raise NotImplementedError(f"Unsupported compare '{compare}'!")
+    counts = {"copied": 0, "added": 0}
+    with ZipReader(base_zip) as base:
+        def reuse(entries: Iterator[tuple]) -> Iterator[tuple]:
+            for arcname, file_path, data in entries:
+                if file_path is not None:  # Image.
+                    info = base.info(arcname) if arcname in base else None
+                    if info is not None and _is_same_file(info, file_path, compare):
+                        counts["copied"] += 1
+                        yield arcname, None, _RawEntry(_copy_zinfo(info), base.read_raw(arcname))
+                        continue
+                    counts["added"] += 1
+                yield arcname, file_path, data
+
+        _zip2stream(reuse(_get_coco_entries(coco_data)), stream, compression, workers)
+    return counts
+
+
+def _is_same_file(info: zipfile.ZipInfo, file_path: str, compare: str) -> bool:
+    if info.flag_bits & 0x1:  # Encrypted.
+        return False
+    st = os.stat(file_path)
+    if st.st_size != info.file_size:
+        return False
+    if compare == "stat":
+        date_time = time.localtime(st.st_mtime)[:6]
+        return date_time[:5] == info.date_time[:5] and date_time[5] // 2 == info.date_time[5] // 2  # DOS time.
+    crc = 0
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc == info.CRC
+
+
+def _copy_zinfo(info: zipfile.ZipInfo) -> zipfile.ZipInfo:
+    """Header of an entry copied from another archive."""
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.CRC = info.CRC
+    zinfo.file_size = info.file_size
+    zinfo.compress_size = info.compress_size
+    return zinfo
+
+
+class _RawEntry:
+    """Entry data already compressed, written as is."""
+    __slots__ = ("zinfo", "payload")
+
+    def __init__(self, zinfo: zipfile.ZipInfo, payload: Union[bytes, memoryview]):
+        self.zinfo = zinfo
+        self.payload = payload
+
+
+def zip_data2bytes(data: List[Union[str, dict, Image.Image]], compression: str = "deflate", workers: int = 0):
     """
     Zip a list of data item to bytes. Entry name is reformatted as file <idx>_<ItemName>.
     :param data: List of data item. Data item can be:
         1. 'str': Means file path (Maybe in LabelStudio style).
         2. 'dict' with key 'b64': Bytes encoded in base64.
+    :param compression: See 'zip_coco2stream'.
+    :param workers: See 'zip_coco2stream'.
     :return:
     """
     with io.BytesIO() as buffer:
-        with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED, True) as zf:
-            for i in range(len(data)):
-                item = data[i]
-                if isinstance(item, str):  # File path.
-                    file_name = os.path.basename(item)
-                    zf.write(realpath(item), f"{i}_{file_name}")
-                elif isinstance(item, Image.Image):  # Image.
-                    im_buffer = io.BytesIO()
-                    item.save(im_buffer, "JPEG")
-                    zf.writestr(f"{i}_{uuid.uuid4()}.jpg", im_buffer.getvalue())
-                elif isinstance(item, dict):  # Data dict.
-                    b64_str = item.get("b64")
-                    if b64_str is not None:
-                        item_bytes = base64.b64decode(b64_str)
-                    else:
-                        raise NotImplementedError(f"Unsupported data dict '{item}'.")
-                    item_name = item.get("name") or str(uuid.uuid4())
-                    zf.writestr(f"{i}_{item_name}", item_bytes)
-                else:
-                    raise NotImplementedError(f"Unknown data '{item}(type={type(item)})'.")
+        zip_data2stream(data, buffer, compression, workers)
         return buffer.getvalue()
 
 
-def iter_files_from_zip_bytes(zip_bytes: bytes) -> List[Tuple[str, bytes]]:
+def zip_data2stream(data: List[Union[str, dict, Image.Image]], stream: BinaryIO, compression: str = "deflate",
+                    workers: int = 0):
+    """Zip a list of data item into a writable binary stream. See 'zip_data2bytes' and 'zip_coco2stream'."""
+    _zip2stream(_iter_data_entries(data), stream, compression, workers)
+
+
+def iter_zip_data(data: List[Union[str, dict, Image.Image]], chunk_size: int = _CHUNK_SIZE,
+                  compression: str = "deflate", workers: int = 0) -> Iterator[bytes]:
+    """Zip a list of data item as chunks of bytes of about 'chunk_size'. See 'zip_data2bytes'."""
+    return _iter_zip_chunks(_iter_data_entries(data), chunk_size, compression, workers)
+
+
+def _iter_data_entries(data: List[Union[str, dict, Image.Image]]) -> Iterator[tuple]:
+    for i in range(len(data)):
+        item = data[i]
+        if isinstance(item, str):  # File path.
+            file_name = os.path.basename(item)
+            yield f"{i}_{file_name}", realpath(item), None
+        elif isinstance(item, Image.Image):  # Image.
+            im_buffer = io.BytesIO()
+            item.save(im_buffer, "JPEG")
+            yield f"{i}_{uuid.uuid4()}.jpg", None, im_buffer.getvalue()
+        elif isinstance(item, dict):  # Data dict.
+            b64_str = item.get("b64")
+            if b64_str is not None:
+                item_bytes = base64.b64decode(b64_str)
+            else:
+                raise NotImplementedError(f"Unsupported data dict '{item}'.")
+            item_name = item.get("name") or str(uuid.uuid4())
+            yield f"{i}_{item_name}", None, item_bytes
+        else:
+            raise NotImplementedError(f"Unknown data '{item}(type={type(item)})'.")
+
+
+def _zip2stream(entries: Iterator[tuple], stream: BinaryIO, compression: str, workers: int):
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED, True) as zf:
+        for _ in _write_entries(zf, entries, compression, workers):
+            pass
+
+
+def _iter_zip_chunks(entries: Iterator[tuple], chunk_size: int, compression: str, workers: int) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, True) as zf:
+        for _ in _write_entries(zf, entries, compression, workers):
+            if sink.size >= chunk_size:
+                yield sink.pop()
+    if sink.size > 0:  # Central directory.
+        yield sink.pop()
+
+
+def _write_entries(zf: zipfile.ZipFile, entries: Iterator[tuple], compression: str, workers: int) -> Iterator:
+    """Write entries into 'zf', yield after each chunk written."""
+    if compression not in ("deflate", "store", "auto"):
+        raise NotImplementedError(f"Unsupported compression '{compression}'!")
+    if workers <= 0:
+        for arcname, file_path, data in entries:
+            yield from _write_entry(zf, arcname, file_path, data, compression)
+        return
+    with ThreadPoolExecutor(workers) as executor:
+        pending = collections.deque()  # (arcname, file_path, future), future is None if written by this thread.
+        for arcname, file_path, data in entries:
+            if file_path is not None and \
+                    (os.path.isdir(file_path) or os.path.getsize(file_path) > _PARALLEL_MAX_SIZE):
+                pending.append((arcname, file_path, None))  # Directory, or large file copied in chunks.
+            else:
+                pending.append((arcname, file_path,
+                                executor.submit(_compress_entry, arcname, file_path, data, compression)))
+            while len(pending) > workers * 2:  # Bound the entries held in memory.
+                yield from _write_pending_entry(zf, pending.popleft(), compression)
+        while pending:
+            yield from _write_pending_entry(zf, pending.popleft(), compression)
+
+
+def _write_pending_entry(zf: zipfile.ZipFile, pending_entry: tuple, compression: str) -> Iterator:
+    arcname, file_path, future = pending_entry
+    if future is None:
+        yield from _write_entry(zf, arcname, file_path, None, compression)
+    else:
+        _write_compressed(zf, *future.result())
+        yield
+
+
+def _write_entry(zf: zipfile.ZipFile, arcname: str, file_path: Optional[str], data: Union[bytes, _RawEntry, None],
+                 compression: str) -> Iterator:
+    if isinstance(data, _RawEntry):
+        _write_compressed(zf, data.zinfo, data.payload)
+        yield
+        return
+    if data is not None:
+        zf.writestr(arcname, data, _choose_compress_type(arcname, data[:_SAMPLE_SIZE], compression))
+        yield
+        return
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    if zinfo.is_dir():
+        zf.write(file_path, arcname)
+        yield
+        return
+    with open(file_path, "rb") as src:
+        chunk = src.read(_CHUNK_SIZE)
+        zinfo.compress_type = _choose_compress_type(arcname, chunk[:_SAMPLE_SIZE], compression)
+        with zf.open(zinfo, "w") as dst:  # Copy in chunks, like 'zf.write'.
+            while chunk:
+                dst.write(chunk)
+                yield
+                chunk = src.read(_CHUNK_SIZE)
+
+
+def _choose_compress_type(arcname: str, sample: bytes, compression: str) -> int:
+    if compression == "deflate":
+        return zipfile.ZIP_DEFLATED
+    elif compression == "store":
+        return zipfile.ZIP_STORED
+    if os.path.splitext(arcname)[1].lower() in _STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if len(sample) > 0 and len(zlib.compress(sample, 1)) > len(sample) * _STORE_RATIO:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _compress_entry(arcname: str, file_path: Optional[str], data: Union[bytes, _RawEntry, None],
+                    compression: str) -> Tuple[zipfile.ZipInfo, bytes]:
+    """Compress an entry in a worker thread. zlib and file reads release the GIL."""
+    if isinstance(data, _RawEntry):
+        return data.zinfo, data.payload
+    if data is None:
+        zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+        with open(file_path, "rb") as f:
+            data = f.read()
+    else:
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+        zinfo.external_attr = 0o600 << 16  # ?rw-------, same as 'zf.writestr'.
+    zinfo.compress_type = _choose_compress_type(arcname, data[:_SAMPLE_SIZE], compression)
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)  # Same as zipfile.
+        payload = compressor.compress(data) + compressor.flush()
+    else:
+        payload = data
+    zinfo.compress_size = len(payload)
+    return zinfo, payload
+
+
+def _write_compressed(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: Union[bytes, memoryview]):
+    """
+    Write an entry compressed by '_compress_entry'. zipfile has no API for it, this follows 'ZipFile.mkdir', which
+    writes a header without a compressor.
+    """
+    with zf._lock:
+        if zf._writing:
+            raise ValueError("Can't write to ZIP archive while an open writing handle exists.")
+        if zf._seekable:
+            zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.fp.write(zinfo.FileHeader())  # Sizes and CRC are known, so no data descriptor.
+        zf.fp.write(payload)
+        zf.start_dir = zf.fp.tell()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Non-seekable stream collecting written bytes until popped."""
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def pop(self) -> bytes:
+        chunk = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return chunk
+
+
+def iter_files_from_zip_bytes(zip_bytes: Union[bytes, memoryview, str]) -> List[Tuple[str, bytes]]:
     """
     Iterate file from zip file bytes.
-    :param zip_bytes:
+    :param zip_bytes: Zip bytes, or any source of 'ZipReader'.
     :return: [(file_name1, file_bytes1), ...]
     """
-    zf = zipfile.ZipFile(io.BytesIO(zip_bytes), "r", zipfile.ZIP_DEFLATED, False)
-    for fileinfo in zf.infolist():
-        yield fileinfo.filename, zf.read(fileinfo)
+    with ZipReader(zip_bytes) as reader:
+        yield from reader.iter_files()
 
 
-def unzip_bytes(zip_bytes: bytes, output_dir: str):
+def unzip_bytes(zip_bytes: Union[bytes, memoryview, str], output_dir: str, workers: int = 0,
+                predicate: Callable[[zipfile.ZipInfo], bool] = None):
     """
     Unzip zip bytes to disk files.
-    :param zip_bytes:
+    :param zip_bytes: Zip bytes, or any source of 'ZipReader'.
     :param output_dir:
+    :param workers: See 'ZipReader.extract_all'.
+    :param predicate: See 'ZipReader.extract_all'.
     :return:
     """
-    zf = zipfile.ZipFile(io.BytesIO(zip_bytes), "r")
-    zf.extractall(output_dir)
+    with ZipReader(zip_bytes) as reader:
+        reader.extract_all(output_dir, workers, predicate)
 
 
-def zip_dir2bytes(dir_path: str):
-    """Zip a directory and its files to bytes. Sub dir included."""
-    dir = Path(dir_path)
+class ZipReader:
+    """
+    Random access reader of a zip archive, reading entries only when asked. The archive is mapped in memory if it's
+    a file path, or read in place if it's bytes or a buffer. Stored entries can be viewed without copying.
+    """
+    def __init__(self, source: Union[str, bytes, bytearray, memoryview, BinaryIO]):
+        """
+        :param source: File path, bytes-like object or readable and seekable binary file.
+        """
+        self._file = None
+        self._mmap = None
+        self._path = None
+        if isinstance(source, (str, Path)):
+            self._path = source
+            self._file = open(source, "rb")
+            try:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file can't be mapped, zipfile reports it.
+                pass
+            self._buffer = memoryview(self._mmap) if self._mmap is not None else None
+            fp = _BufferReader(self._buffer) if self._buffer is not None else self._file
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self._buffer = memoryview(source).cast("B")
+            fp = _BufferReader(self._buffer)
+        else:
+            self._buffer = None
+            fp = source
+        self._fp = fp
+        self._zf = zipfile.ZipFile(fp, "r")
+
+    def names(self) -> List[str]:
+        return self._zf.namelist()
+
+    def info(self, name: str) -> zipfile.ZipInfo:
+        """:raise KeyError: If the entry doesn't exist."""
+        return self._zf.getinfo(name)
+
+    def open(self, name: str) -> IO[bytes]:
+        """Open an entry as a stream decompressing on read."""
+        return self._zf.open(name)
+
+    def read(self, name: str) -> bytes:
+        return self._zf.read(name)
+
+    def view(self, name: str) -> memoryview:
+        """
+        Content of an entry. A stored entry is a slice of the archive without copying when the archive is a file path
+        or a buffer, the others are read. Views must be released before closing this reader.
+        """
+        info = self.info(name)
+        if self._buffer is None or info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:  # Encrypted.
+            return memoryview(self.read(name))
+        data = self.read_raw(name)
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 of '{name}'!")
+        return data
+
+    def read_raw(self, name: str) -> Union[memoryview, bytes]:
+        """
+        Compressed content of an entry as stored in the archive, a slice without copying if the archive is a file path
+        or a buffer.
+        """
+        info = self.info(name)
+        return self._read_at(self._get_data_offset(info), info.compress_size)
+
+    def _get_data_offset(self, info: zipfile.ZipInfo, file: Optional[BinaryIO] = None) -> int:
+        """Offset of the compressed content of an entry, after its local file header."""
+        header = self._read_at(info.header_offset, zipfile.sizeFileHeader, file)
+        if len(header) != zipfile.sizeFileHeader or bytes(header[:4]) != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad local file header of '{info.filename}'!")
+        name_size, extra_size = struct.unpack("<HH", header[26:30])
+        return info.header_offset + zipfile.sizeFileHeader + name_size + extra_size
+
+    def _read_at(self, offset: int, size: int, file: Optional[BinaryIO] = None) -> Union[memoryview, bytes]:
+        """:param file: Own file of the archive of the calling thread. None: The shared one."""
+        if self._buffer is not None:
+            return self._buffer[offset: offset + size]
+        if file is not None:
+            file.seek(offset)
+            return file.read(size)
+        with self._zf._lock:  # The file is shared with zipfile.
+            self._fp.seek(offset)
+            return self._fp.read(size)
+
+    def _iter_raw_chunks(self, info: zipfile.ZipInfo, file: Optional[BinaryIO] = None) -> Iterator:
+        """Compressed content of an entry in chunks, slices without copying if the archive is a buffer."""
+        offset = self._get_data_offset(info, file)
+        end = offset + info.compress_size
+        while offset < end:
+            chunk = self._read_at(offset, min(_CHUNK_SIZE, end - offset), file)
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated content of '{info.filename}'!")
+            offset += len(chunk)
+            yield chunk
+
+    def iter_files(self) -> Iterator[Tuple[str, bytes]]:
+        """Iterate (file_name, file_bytes), each file is read when reached."""
+        for fileinfo in self._zf.infolist():
+            yield fileinfo.filename, self._zf.read(fileinfo)
+
+    def extract_all(self, output_dir: str, workers: int = 0, predicate: Callable[[zipfile.ZipInfo], bool] = None):
+        """
+        Extract entries to 'output_dir', like 'ZipFile.extractall'.
+        :param output_dir:
+        :param workers: Count of threads extracting files. Directories are created first, then the threads read the
+            content of stored or deflated entries in place, by their own file of the archive if it isn't in memory,
+            without parsing the archive again. 0: Extract in the current thread.
+        :param predicate: Extract the entries it returns True for. None: Extract all.
+        """
+        infos = [x for x in self._zf.infolist() if predicate is None or predicate(x)]
+        if workers <= 0:
+            for info in infos:
+                self._zf.extract(info, output_dir)
+            return
+        targets = [_get_extract_path(x, output_dir) for x in infos]
+        dirs = {x if y.is_dir() else os.path.dirname(x) for x, y in zip(targets, infos)}
+        for dir_path in sorted(dirs):  # Parents first.
+            os.makedirs(dir_path, exist_ok=True)
+        local = threading.local()
+        files = []
+        lock = threading.Lock()
+
+        def extract(info: zipfile.ZipInfo, target: str):
+            with open(target, "wb") as dst:
+                if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or info.flag_bits & 0x1 or \
+                        (self._buffer is None and self._path is None):  # Encrypted, or a stream not reopenable.
+                    with self._zf.open(info) as src:  # Reads of the shared file are locked by zipfile.
+                        shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+                    return
+                file = None
+                if self._buffer is None:
+                    file = getattr(local, "file", None)
+                    if file is None:
+                        file = local.file = open(self._path, "rb")
+                        with lock:
+                            files.append(file)
+                _write_decompressed(info, self._iter_raw_chunks(info, file), dst)
+
+        try:
+            with ThreadPoolExecutor(workers) as executor:
+                for future in [executor.submit(extract, x, y) for x, y in zip(infos, targets) if not x.is_dir()]:
+                    future.result()
+        finally:
+            for file in files:
+                file.close()
+
+    def close(self):
+        """
+        Close the archive. Slices returned by 'view' or 'read_raw' stay valid, a mapping still referenced by them is
+        unmapped when they are released.
+        """
+        try:
+            self._zf.close()
+            if self._buffer is not None:
+                self._buffer.release()
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:  # Slices exported, the mapping is closed when it's freed.
+                    pass
+                self._mmap = None
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._zf.NameToInfo
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names())
+
+    def __len__(self) -> int:
+        return len(self._zf.filelist)
+
+    def __enter__(self) -> 'ZipReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _write_decompressed(info: zipfile.ZipInfo, chunks: Iterator, dst: BinaryIO):
+    """
+    Write the content of a stored or deflated entry from the chunks of its compressed content, checking its CRC-32.
+    """
+    decompressor = zlib.decompressobj(-15) if info.compress_type == zipfile.ZIP_DEFLATED else None
+    crc = size = 0
+    for chunk in chunks:
+        while len(chunk):
+            if decompressor is None:
+                data, chunk = chunk, b""
+            else:  # Bound the inflated data held in memory.
+                data = decompressor.decompress(chunk, _CHUNK_SIZE)
+                chunk = decompressor.unconsumed_tail
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            dst.write(data)
+    if decompressor is not None:
+        data = decompressor.flush()
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        dst.write(data)
+    if crc != info.CRC or size != info.file_size:
+        raise zipfile.BadZipFile(f"Bad CRC-32 of '{info.filename}'!")
+
+
+def _get_extract_path(info: zipfile.ZipInfo, output_dir: str) -> str:
+    """Target path of an entry, sanitized the same way as 'ZipFile.extract'."""
+    arcname = info.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    if os.path.sep == '\\':
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+    return os.path.normpath(os.path.join(output_dir, arcname))
+
+
+class _BufferReader(io.RawIOBase):
+    """Readable and seekable stream over a buffer, reads copy only the bytes read."""
+    def __init__(self, buffer: memoryview):
+        super().__init__()
+        self._buffer = buffer
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._buffer[self._pos: self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._buffer) + offset
+        else:
+            raise ValueError(f"Invalid whence '{whence}'!")
+        if self._pos < 0:
+            raise ValueError("Negative seek position!")
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def zip_dir2bytes(dir_path: str, compression: str = "deflate", workers: int = 0):
+    """Zip a directory and its files to bytes. Sub dir included. See 'zip_coco2stream' for the arguments."""
     with io.BytesIO() as buffer:
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for entry in dir.rglob("*"):
-                zip_file.write(entry, entry.relative_to(dir))
+        zip_dir2stream(dir_path, buffer, compression, workers)
         return buffer.getvalue()
 
 
-def unzip_bytes2dir(zip_bytes: bytes, output_dir: str):
+def zip_dir2stream(dir_path: str, stream: BinaryIO, compression: str = "deflate", workers: int = 0):
+    """Zip a directory and its files into a writable binary stream. Sub dir included. See 'zip_coco2stream'."""
+    _zip2stream(_iter_dir_entries(dir_path), stream, compression, workers)
+
+
+def iter_zip_dir(dir_path: str, chunk_size: int = _CHUNK_SIZE, compression: str = "deflate",
+                 workers: int = 0) -> Iterator[bytes]:
+    """Zip a directory and its files as chunks of bytes of about 'chunk_size'. Sub dir included."""
+    return _iter_zip_chunks(_iter_dir_entries(dir_path), chunk_size, compression, workers)
+
+
+def _iter_dir_entries(dir_path: str) -> Iterator[tuple]:
+    dir = Path(dir_path)
+    for entry in dir.rglob("*"):
+        yield str(entry.relative_to(dir)), str(entry), None
+
+
+def unzip_bytes2dir(zip_bytes: Union[bytes, memoryview, str], output_dir: str, workers: int = 0,
+                    predicate: Callable[[zipfile.ZipInfo], bool] = None):
     """
     Unzip zip bytes to disk files.
-    :param zip_bytes:
+    :param zip_bytes: Zip bytes, or any source of 'ZipReader'.
     :param output_dir:
+    :param workers: See 'ZipReader.extract_all'.
+    :param predicate: See 'ZipReader.extract_all'.
     :return:
     """
-    zf = zipfile.ZipFile(io.BytesIO(zip_bytes), "r")
-    zf.extractall(output_dir)
+    with ZipReader(zip_bytes) as reader:
+        reader.extract_all(output_dir, workers, predicate)
 
 
-def iter_files4zip_bytes(zip_bytes: bytes) -> List[Tuple[str, bytes]]:
+def iter_files4zip_bytes(zip_bytes: Union[bytes, memoryview, str]) -> List[Tuple[str, bytes]]:
     """
     Iterate file from zip file bytes.
-    :param zip_bytes:
+    :param zip_bytes: Zip bytes, or any source of 'ZipReader'.
     :return: [(file_name1, file_bytes1), ...]
     """
-    zf = zipfile.ZipFile(io.BytesIO(zip_bytes), "r", zipfile.ZIP_DEFLATED, False)
-    for fileinfo in zf.infolist():
-        yield fileinfo.filename, zf.read(fileinfo)
+    with ZipReader(zip_bytes) as reader:
+        yield from reader.iter_files()
 
 
 class NestedListFlatter:
@@ -2,19 +2,61 @@
 # @Time         : 19:10 2023/6/10
 # @Author       : Chris
 # @Description  : Extract list of data tree to data rows([{field1: value11, ...}, {field1: value21, ...}]).
+import codecs
+import collections
+import csv
+import hashlib
+import io
+import json
+import linecache
+import operator
+import os
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Any, Callable, Optional, Tuple, Iterable, Iterator, Union, BinaryIO, TextIO
 
 from jsonpath_ng import ext as jsonpath
+from jsonpath_ng import jsonpath as jsonpath_ast
+from lxml import etree
 from lxml.etree import _Comment as XmlComment
 from lxml.etree import _Element as XmlElement
+from lxml.etree import _ElementTree as XmlDocument
 
 
 class MappingTreeNode:
-    def __init__(self):
-        self.tag: str = None
+    """
+    A compiled mapping config node. Known attributes are parsed and typed once, the others are kept in 'extra_attrs'.
+    """
+    __slots__ = ("tag", "engine", "children", "expr", "path", "field", "optional", "delimiter", "extra_attrs",
+                 "_attr_names")
+    _TYPED_ATTRS = ("path", "field", "optional", "delimiter")
+    _BUILTIN_ATTRS = ("tag", "engine", "children", "expr")
+
+    def __init__(self, tag: str = None, attrib: Dict[str, str] = None):
+        """
+        :param attrib: XML attributes of the config node.
+        """
+        self.tag: str = tag
         self.engine: ExtractionEngine = None
         self.children: List[MappingTreeNode] = []
+        self.expr: Any = None  # Compiled 'path', see 'ExtractionEngine.compile'.
+        self.path: Optional[str] = None
+        self.field: str = "value"
+        self.optional: bool = False
+        self.delimiter: str = ","
+        self.extra_attrs: Dict[str, str] = {}
+        attrib = attrib or {}
+        self._attr_names = tuple(attrib.keys())  # Names of present attributes in XML order.
+        for name, value in attrib.items():
+            if name == "optional":
+                self.optional = value == "True"
+            elif name in self._TYPED_ATTRS:
+                setattr(self, name, value)
+            elif name not in self._BUILTIN_ATTRS:
+                self.extra_attrs[name] = value
 
     def has_attr(self, name: str):
         """
@@ -22,7 +64,7 @@ class MappingTreeNode:
         :param name:
         :return:
         """
-        return name in self.__dict__
+        return name in self._BUILTIN_ATTRS or name in self._attr_names
 
     def get_attr(self, name: str, default):
         """
@@ -31,29 +73,215 @@ class MappingTreeNode:
         :param name:
         :return:
         """
-        return self.__dict__[name] if name in self.__dict__ else default
+        if name in self._BUILTIN_ATTRS or (name in self._TYPED_ATTRS and name in self._attr_names):
+            return getattr(self, name)
+        return self.extra_attrs.get(name, default)
 
     def __str__(self):
-        attr_str = ", ".join(f"{name}={value}" for name, value in self.__dict__.items()
-                             if name != "children" and name != "tag")
+        attr_str = ", ".join([f"engine={self.engine}"] +
+                             [f"{name}={self.get_attr(name, None)}" for name in self._attr_names
+                              if name not in self._BUILTIN_ATTRS])
         return f"{self.tag}({attr_str})"
 
 
 class ExtractionEngine(ABC):
+    def compile(self, path: str) -> Any:
+        """
+        Compile 'path' once at mapping tree compile time. The returned expression is passed to 'parse' as 'path'.
+        Returns 'path' itself by default.
+        """
+        return path
+
     @abstractmethod
     def parse(self, data_node, path, conf_node: MappingTreeNode):
         """
+        :param path: The expression returned by 'compile'.
         :rtype: List[Any]
         """
         pass
 
+    def parse_batch(self, data_nodes: List[Any], path, conf_node: MappingTreeNode) -> List[List[Any]]:
+        """
+        Parse sibling data nodes with the same path at once. Override to amortize work across the batch.
+        :param data_nodes: Data nodes, None excluded.
+        :return: Result of 'parse' for each data node.
+        """
+        return [self.parse(data_node, path, conf_node) for data_node in data_nodes]
+
+
+_MISSING = object()  # Marks a getter step that found nothing.
+
+
+class SimpleJsonPath:
+    """
+    A jsonpath lowered to a chain of plain dict/list getters, skipping jsonpath-ng's object model(DatumInContext,
+    full path tracking). Only root, fields, indices and slices are lowered, e.g. '$.a.b[0].c' or '$.items[*].name'.
+    Every getter mirrors the 'find' of its jsonpath-ng counterpart, so results are identical.
+    """
+    def __init__(self, steps: List[Tuple[Callable[[Any], Any], bool]], source):
+        """
+        :param steps: (getter, fan_out) pairs. A fan-out getter returns a list of values, others return a single
+            value or '_MISSING'.
+        :param source: The lowered jsonpath-ng expression.
+        """
+        self._steps = steps
+        self._scalar = not any(fan_out for _, fan_out in steps)
+        self._source = source
+
+    def __reduce__(self):
+        return SimpleJsonPath.lower, (self._source,)  # Getters are closures, lower again when unpickled.
+
+    @staticmethod
+    def lower(expr) -> Optional["SimpleJsonPath"]:
+        """
+        Lower a parsed jsonpath expression. Returns None if it uses anything beyond the simple subset.
+        """
+        if jsonpath_ast.auto_id_field is not None:
+            return None
+        steps = []
+        if not SimpleJsonPath._r_lower(expr, steps, True):
+            return None
+        return SimpleJsonPath(steps, expr)
+
+    def find(self, data) -> List[Any]:
+        """Returns the extracted values(not DatumInContext)."""
+        if self._scalar:
+            for getter, _ in self._steps:
+                data = getter(data)
+                if data is _MISSING:
+                    return []
+            return [data]
+        values = [data]
+        for getter, fan_out in self._steps:
+            if fan_out:
+                values = [y for x in values for y in getter(x)]
+            else:
+                values = [y for y in map(getter, values) if y is not _MISSING]
+            if not values:
+                break
+        return values
+
+    @staticmethod
+    def _r_lower(expr, steps: list, leftmost: bool) -> bool:
+        expr_type = type(expr)  # Exact types, jsonpath.ext subclasses them with different semantics.
+        if expr_type is jsonpath_ast.Child:
+            return SimpleJsonPath._r_lower(expr.left, steps, leftmost) and \
+                SimpleJsonPath._r_lower(expr.right, steps, False)
+        elif expr_type is jsonpath_ast.Root:
+            return leftmost  # '$' is the input data node itself only at the beginning.
+        elif expr_type is jsonpath_ast.Fields:
+            fields = expr.fields
+            if len(fields) == 1 and fields[0] != "*":
+                steps.append((SimpleJsonPath._field_getter(fields[0]), False))
+            else:
+                steps.append((SimpleJsonPath._fields_getter(fields), True))
+            return True
+        elif expr_type is jsonpath_ast.Index:
+            indices = getattr(expr, "indices", None)
+            if indices is None:  # Legacy jsonpath-ng, semantics differ.
+                return False
+            if len(indices) == 1:
+                steps.append((SimpleJsonPath._index_getter(indices[0]), False))
+            else:
+                steps.append((SimpleJsonPath._indices_getter(indices), True))
+            return True
+        elif expr_type is jsonpath_ast.Slice:
+            steps.append((SimpleJsonPath._slice_getter(expr.start, expr.end, expr.step), True))
+            return True
+        return False
+
+    @staticmethod
+    def _field_getter(name: str):
+        def get(value):
+            try:
+                return value.get(name, _MISSING)
+            except (TypeError, AttributeError):
+                return _MISSING
+        return get
+
+    @staticmethod
+    def _fields_getter(names: Tuple[str, ...]):
+        def get(value):
+            if "*" in names:
+                try:
+                    keys = tuple(value.keys())
+                except AttributeError:
+                    return []
+            else:
+                keys = names
+            res = []
+            for key in keys:
+                try:
+                    field_value = value.get(key, _MISSING)
+                except (TypeError, AttributeError):
+                    continue
+                if field_value is not _MISSING:
+                    res.append(field_value)
+            return res
+        return get
+
+    @staticmethod
+    def _index_getter(index: int):
+        def get(value):
+            if isinstance(value, dict):
+                return _MISSING
+            if value and -len(value) <= index < len(value):
+                return value[index]
+            return _MISSING
+        return get
+
+    @staticmethod
+    def _indices_getter(indices: Tuple[int, ...]):
+        def get(value):
+            if isinstance(value, dict):
+                return []
+            return [value[i] for i in indices if value and -len(value) <= i < len(value)]
+        return get
+
+    @staticmethod
+    def _slice_getter(start, end, step):
+        whole = start is None and end is None and step is None
+
+        def get(value):
+            if value is None:
+                return []
+            if isinstance(value, (dict, int, float, str, bool)):  # jsonpath-ng wraps these as a 1-element list.
+                value = [value]
+            indices = range(0, len(value))
+            if not whole:
+                indices = indices[start:end:step]
+            return [value[i] for i in indices]
+        return get
+
 
 class JsonEngine(ExtractionEngine):
+    def __init__(self, lower_simple_paths: bool = True):
+        """
+        :param lower_simple_paths: Lower paths in the simple subset to 'SimpleJsonPath'.
+        """
+        self._lower_simple_paths = lower_simple_paths
+
+    def compile(self, path: str) -> Any:
+        expr = jsonpath.parse(path)
+        if self._lower_simple_paths:
+            return SimpleJsonPath.lower(expr) or expr
+        return expr
+
     def parse(self, data_node, path, conf_node: MappingTreeNode):
-        extracted = jsonpath.parse(path).find(data_node)
+        expr = self.compile(path) if isinstance(path, str) else path
+        if isinstance(expr, SimpleJsonPath):
+            return expr.find(data_node)
+        extracted = expr.find(data_node)
         extracted = [e.value for e in extracted]
         return extracted
 
+    def parse_batch(self, data_nodes: List[Any], path, conf_node: MappingTreeNode) -> List[List[Any]]:
+        expr = self.compile(path) if isinstance(path, str) else path
+        find = expr.find
+        if isinstance(expr, SimpleJsonPath):
+            return [find(data_node) for data_node in data_nodes]
+        return [[e.value for e in find(data_node)] for data_node in data_nodes]
+
     def __str__(self):
         return "jsonpath-ng"
 
@@ -67,6 +295,18 @@ class ObjectEngine(ExtractionEngine):
             return [getattr(data_node, path)]
         return []
 
+    def parse_batch(self, data_nodes: List[Any], path, conf_node: MappingTreeNode) -> List[List[Any]]:
+        if "." in path:  # 'attrgetter' would walk a dotted path, 'getattr' doesn't.
+            return super().parse_batch(data_nodes, path, conf_node)
+        getter = operator.attrgetter(path)
+        res = []
+        for data_node in data_nodes:
+            try:
+                res.append([getter(data_node)])
+            except AttributeError:
+                res.append([])
+        return res
+
     def __str__(self):
         return "object"
 
@@ -86,17 +326,10 @@ class MappingTree:
 
     @staticmethod
     def _r_compile(xml_node: XmlElement, parent_engine: ExtractionEngine):
-        m_node = MappingTreeNode()
         # 1 Collect attributes.
-        # 1.1 General collecting.
-        m_node.tag = xml_node.tag
-        for attr in xml_node.attrib.items():
-            m_node.__dict__[attr[0]] = attr[1]
-        # 1.2 Convert some data.
-        if m_node.has_attr("optional"):
-            m_node.__dict__["optional"] = m_node.get_attr("optional", "True") == "True"
+        m_node = MappingTreeNode(xml_node.tag, dict(xml_node.attrib))
         # 2 Create engine.
-        engine_name = m_node.engine
+        engine_name = xml_node.get("engine")
         if isinstance(engine_name, str):
             engine = MappingTree.__name2engine.get(engine_name)
             if engine is None:
@@ -104,6 +337,9 @@ class MappingTree:
         else:  # 'engine' is None, inherit parent's engine.
             engine = parent_engine
         m_node.engine = engine
+        # 2.1 Compile path expression.
+        if m_node.path:
+            m_node.expr = engine.compile(m_node.path)
         # 3. Collect children.
         for x_child_node in xml_node.iterchildren():
             if isinstance(x_child_node, XmlComment):  # Ignore comment.
@@ -119,60 +355,733 @@ class MappingTree:
 
 
 MappingTree.register("json", JsonEngine())
+MappingTree.register("jsonpath", JsonEngine(lower_simple_paths=False))  # Always the full jsonpath-ng.
 MappingTree.register("object", ObjectEngine())
 
 
+class ExtractorCodeGenerator:
+    """
+    Generate a specialized python function for a mapping tree, one nested function per mapping tree node.
+    Tag dispatch, optional flags, field names and delimiters are resolved at generation time. Behaviour and error
+    messages are the same as 'TreeExtractor._r_extract'.
+    """
+    def __init__(self, mapping: MappingTreeNode):
+        self._mapping = mapping
+        self._namespace: Dict[str, Any] = {}
+        self._lines: List[str] = []
+        self._func2conf: Dict[str, str] = {}
+        self._n_funcs = 0
+
+    def generate(self) -> Callable[..., None]:
+        """
+        :return: A function(data_node, res, parsed=None, memo=None) extracting a data item into the dict 'res'.
+        """
+        self._namespace = {
+            "_BASIC_TYPES": (str, int, float, type(None)),
+            "_remove_empty_str": TreeExtractor._remove_empty_str,
+            "_parse_batch": TreeExtractor._parse_batch,
+        }
+        self._func2conf = {}
+        self._lines = []
+        self._n_funcs = 0
+        entry = self._r_generate(self._mapping)
+        source = "\n".join(self._lines) + "\n"
+        filename = f"<t2r {self._mapping.tag}@{id(self._mapping):x}>"
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)  # Readable tracebacks.
+        exec(compile(source, filename, "exec"), self._namespace)
+        return self._namespace[entry]
+
+    @property
+    def source(self) -> str:
+        """Source code of the last generation."""
+        return "\n".join(self._lines)
+
+    def _r_generate(self, node: MappingTreeNode) -> str:
+        """Generate functions of 'node' and its descendants(children first). Returns the function name."""
+        child_funcs = [self._r_generate(c) for c in node.children]
+        i = self._n_funcs
+        self._n_funcs += 1
+        func = f"_n{i}"
+        desc = f"_desc{i}"
+        self._namespace[desc] = str(node)
+        is_optional = node.optional
+        field = node.field
+        emit = self._emit
+        self._namespace[f"_conf{i}"] = node
+        self._func2conf[func] = f"_conf{i}"
+        if node.tag in SubtreeMemo.TAGS:  # Wrap the node function with memo.
+            emit(0, f"def {func}(data_node, res, parsed=None, memo=None):")
+            emit(1, "if memo is None or data_node is None:")
+            emit(2, f"{func}_(data_node, res, parsed, memo)")
+            emit(1, "else:")
+            emit(2, f"memo.run(_conf{i}, data_node, res, lambda fields: {func}_(data_node, fields, parsed, memo))")
+            emit(0, f"def {func}_(data_node, res, parsed, memo):")
+        else:
+            emit(0, f"def {func}(data_node, res, parsed=None, memo=None):")
+        # 1. Check input and prepare data.
+        if not is_optional:
+            emit(1, "if data_node is None:")
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Input data for non-optional "
+                    f"'{node.tag}' shouldn't be 'None'.\")")
+        if node.path:
+            if type(node.engine).parse is JsonEngine.parse and isinstance(node.expr, SimpleJsonPath):
+                self._namespace[f"_find{i}"] = node.expr.find  # Skip the engine dispatch, unless 'parse' is overridden.
+                parse = f"_remove_empty_str(_find{i}(data_node))"
+            else:
+                self._namespace[f"_parse{i}"] = node.engine.parse
+                self._namespace[f"_expr{i}"] = node.expr
+                parse = f"_remove_empty_str(_parse{i}(data_node, _expr{i}, _conf{i}))"
+            emit(1, "if parsed is None:")  # Not parsed in a batch.
+            emit(2, f"extracted = [] if data_node is None else {parse}" if is_optional else f"extracted = {parse}")
+            emit(1, "else:")
+            emit(2, "extracted = _remove_empty_str(parsed)")
+        else:
+            emit(1, "extracted = [] if data_node is None or (isinstance(data_node, str) and "
+                    "(data_node == '' or data_node.isspace())) else [data_node]")
+        # 2. Parse.
+        generate_tag = getattr(self, f"_gen_{node.tag}", None)
+        if generate_tag is None:
+            message = f"Unsupported config node type '{node.tag}'"
+            emit(1, f"raise NotImplementedError({message!r})")
+        else:
+            generate_tag(desc, is_optional, repr(field), node, child_funcs)
+        return func
+
+    def _emit(self, indent: int, line: str):
+        self._lines.append("    " * indent + line)
+
+    def _gen_table(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        if len(child_funcs) > 1:
+            emit(1, "raise NotImplementedError()")
+            return
+        batches = self._emit_parse_batches(node, child_funcs)
+        emit(1, "for i, child_data_node in enumerate(extracted):")
+        for child_func, parsed in zip(child_funcs, batches):
+            emit(2, f"{child_func}(child_data_node, res, {parsed}, memo)")
+        if not child_funcs:
+            emit(2, "pass")
+
+    def _gen_rows(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        if not is_optional:
+            emit(1, "if len(extracted) == 0:")
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Path of non-optional 'rows' extracted nothing.\")")
+        batches = self._emit_parse_batches(node, child_funcs)
+        emit(1, "for i, child_data_node in enumerate(extracted):")
+        emit(2, "row = {}")
+        for child_func, parsed in zip(child_funcs, batches):
+            emit(2, f"{child_func}(child_data_node, row, {parsed}, memo)")
+        emit(2, "for field, data_item in row.items():")
+        emit(3, "if field in res:")
+        emit(4, f"raise RuntimeError(f\"{{{desc}}}: Duplicate field '{{field}}'. \"")
+        emit(4, "                   f\"Existing value='{res[field]}', incoming value='{data_item}'.\")")
+        emit(3, "res[field] = data_item")
+
+    def _gen_items(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        emit(1, "if len(extracted) > 1:")
+        emit(2, f"raise RuntimeError(f\"{{{desc}}}: There shouldn't be more than 1 extracted data nodes.\")")
+        emit(1, "elif len(extracted) == 0:")
+        if is_optional:
+            emit(2, "child_data_node = None")
+        else:
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Non-optional 'items' needs at least 1 "
+                    f"extracted data node.\")")
+        emit(1, "else:")
+        emit(2, "child_data_node = extracted[0]")
+        if child_funcs:
+            emit(1, "field2child_data_item = {}")
+            for child_func in child_funcs:
+                emit(1, f"{child_func}(child_data_node, field2child_data_item, None, memo)")
+            emit(1, "res.update(field2child_data_item)")
+
+    def _gen_itemAny(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        emit(1, "if len(extracted) == 0:")
+        if not is_optional:
+            emit(2, f"raise Exception(f\"{{{desc}}}: Non-optional itemAny should provide "
+                    f"at lease 1 extracted data node.\")")
+        else:
+            emit(2, f"res[{field}] = None")
+            emit(2, "return")
+        if not child_funcs:  # A leaf 'itemAny'.
+            emit(1, f"res[{field}] = extracted[0]")
+            return
+        emit(1, "for child_data_node in extracted:")
+        for child_func in child_funcs:
+            emit(2, "field2child_data_item = {}")
+            emit(2, f"{child_func}(child_data_node, field2child_data_item, None, memo)")
+            emit(2, "child_res_value = field2child_data_item['value']")
+            emit(2, "if child_res_value:")
+            emit(3, f"res[{field}] = child_res_value")
+            emit(3, "return")
+        if not is_optional:
+            emit(1, f"raise RuntimeError(f\"{{{desc}}}: Non-optional itemAny should return 1 data node.\")")
+        else:
+            emit(1, f"res[{field}] = None")  # Nothing found.
+
+    def _gen_itemAll(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        if not is_optional:
+            emit(1, "if len(extracted) == 0:")
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Non-optional itemAll should provide "
+                    f"at least 1 extracted data node.\")")
+        emit(1, "items = []")
+        emit(1, "for child_data_node in extracted:")
+        emit(2, "if isinstance(child_data_node, _BASIC_TYPES):")
+        emit(3, "items.append(child_data_node)")
+        emit(2, "else:")
+        if not child_funcs:  # No child extractor.
+            emit(3, "items = extracted")
+        for child_func in child_funcs:
+            self._emit_child_value(3, child_func)
+            emit(3, "if child_data_item is not None:")
+            emit(4, "items.append(child_data_item)")
+        emit(1, "if len(items) == 0:")
+        if not is_optional:
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Non-optional itemAll should return at lease 1 data item.\")")
+        else:
+            emit(2, f"res[{field}] = None")
+        emit(1, "else:")
+        emit(2, f"res[{field}] = items")
+
+    def _gen_itemJoin(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        emit(1, "if len(extracted) == 0:")
+        if not is_optional:
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Non-optional itemJoin should provide "
+                    f"at least 1 extracted data node.\")")
+        else:
+            emit(2, f"res[{field}] = None")
+            emit(2, "return")
+        emit(1, "data_strs = []")
+        emit(1, "for child_data_node in extracted:")
+        emit(2, "if isinstance(child_data_node, _BASIC_TYPES):")
+        emit(3, "data_strs.append(str(child_data_node))")
+        if child_funcs:
+            emit(2, "else:")
+        for child_func in child_funcs:
+            self._emit_child_value(3, child_func)
+            emit(3, "if child_data_item is not None:")
+            emit(4, "data_strs.append(str(child_data_item))")
+        emit(1, "filtered = [x for x in (s.strip() for s in data_strs) if x != '']")
+        emit(1, "if len(filtered) == 0:")
+        if is_optional:
+            emit(2, f"res[{field}] = None")
+        else:
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Non-optional itemJoin should return 1 non-empty string.\")")
+        emit(1, "else:")
+        emit(2, f"res[{field}] = {node.delimiter!r}.join(filtered)")
+
+    def _gen_item(self, desc: str, is_optional: bool, field: str, node: MappingTreeNode, child_funcs: List[str]):
+        emit = self._emit
+        emit(1, "if len(extracted) > 1:")
+        emit(2, f"raise Exception(f\"{{{desc}}}: 'item' node is forbidden extracting multiple pieces of data. \"")
+        emit(2, "                f\"Data extracted: [{', '.join(extracted)}]\")")
+        emit(1, "elif len(extracted) == 0:")
+        if not is_optional:
+            emit(2, f"raise RuntimeError(f\"{{{desc}}}: Non-optional 'item' should extract 1 data item.\")")
+        else:
+            emit(2, f"res[{field}] = None")  # Nothing found.
+        emit(1, "else:")
+        emit(2, "data_item = extracted[0]")
+        emit(2, "if not isinstance(data_item, _BASIC_TYPES):")
+        emit(3, f"raise RuntimeError(f\"{{{desc}}}: Simple 'item' node should return some data of basic types. \"")
+        emit(3, "                   f\"Got {type(data_item)}.\")")
+        emit(2, f"res[{field}] = data_item")
+
+    def _emit_parse_batches(self, node: MappingTreeNode, child_funcs: List[str]) -> List[str]:
+        """
+        Parse 'extracted' with the path of each child at once, see 'TreeExtractor._parse_batch'.
+        :return: Argument 'parsed' of each child function.
+        """
+        args = []
+        for j, (child, child_func) in enumerate(zip(node.children, child_funcs)):
+            if child.expr is None:
+                args.append("None")
+                continue
+            self._emit(1, f"batch{j} = _parse_batch({self._func2conf[child_func]}, extracted)")
+            args.append(f"None if batch{j} is None else batch{j}[i]")
+        return args
+
+    def _emit_child_value(self, indent: int, child_func: str):
+        """Run a child function on 'child_data_node', keep its first value as 'child_data_item'."""
+        self._emit(indent, "field2child_data_item = {}")
+        self._emit(indent, f"{child_func}(child_data_node, field2child_data_item, None, memo)")
+        self._emit(indent, "child_data_item = next(iter(field2child_data_item.values()))")
+
+
+class ExtractionError(RuntimeError):
+    """
+    Extraction of a single item in a batch failed.
+    """
+    def __init__(self, index: int, error: BaseException):
+        """
+        :param index: Index of the failed item in the input items.
+        :param error: The original error.
+        """
+        super().__init__(f"Failed to extract item {index}: {type(error).__name__}: {error}")
+        self.index = index
+        self.error = error
+
+    def __reduce__(self):
+        return ExtractionError, (self.index, self.error)
+
+
+class _ColumnBuffer:
+    """
+    Values of a column. Starts as a typed array if the first value is an int or float, falls back to a list once a
+    value of another type(None included) or out of range comes.
+    """
+    __slots__ = ("values", "_type")
+    _TYPECODES = {int: "q", float: "d"}
+
+    def __init__(self, n_absent: int):
+        """
+        :param n_absent: Number of preceding rows without this field.
+        """
+        self.values: Union[array, list] = [None] * n_absent
+        self._type = None if n_absent else _MISSING  # '_MISSING': Decided by the first value.
+
+    def append(self, value):
+        value_type = type(value)
+        if self._type is _MISSING:
+            typecode = self._TYPECODES.get(value_type)
+            self._type = value_type if typecode else None
+            if typecode:
+                self.values = array(typecode)
+        if self._type is not None:
+            if value_type is self._type:
+                try:
+                    self.values.append(value)
+                    return
+                except OverflowError:
+                    pass
+            self.values = self.values.tolist()
+            self._type = None
+        self.values.append(value)
+
+    def to_numpy(self):
+        import numpy as np
+        if isinstance(self.values, array):
+            return np.frombuffer(self.values, dtype=np.int64 if self.values.typecode == "q" else np.float64)
+        column = np.empty(len(self.values), dtype=object)
+        column[:] = self.values
+        return column
+
+
+class SubtreeMemo:
+    """
+    Bounded LRU memo of 'items', 'itemAll' and 'itemJoin' subtree results within a batch, for inputs referencing the
+    same nested object many times. Results are identical to extracting the subtree again, for keying by content only
+    if the data nodes are JSON-decoded, since JSON doesn't tell tuples from lists or int keys from str keys.
+    """
+    TAGS = ("items", "itemAll", "itemJoin")
+
+    def __init__(self, max_size: int = 4096, by_content: bool = False):
+        """
+        :param by_content: Key data nodes by a digest of their JSON content instead of identity, so that equal
+            subtrees decoded separately share a result. Key order is part of the content, as wildcard paths follow it.
+            Data nodes that can't be serialized as JSON are not memoized.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._by_content = by_content
+        # key: (data node or None if keyed by content, written fields)
+        self._key2entry: collections.OrderedDict = collections.OrderedDict()
+
+    def run(self, conf_node: MappingTreeNode, data_node, res: dict, extract: Callable[[dict], None]):
+        """
+        Write the result of subtree 'conf_node' on 'data_node' into 'res'.
+        :param extract: Extract the subtree into the given dict, called on a miss.
+        """
+        if self._by_content:
+            try:
+                content = json.dumps(data_node, separators=(",", ":"))  # ASCII, even for lone surrogates.
+            except (TypeError, ValueError):
+                extract(res)
+                return
+            key = conf_node, hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+        else:
+            key = conf_node, id(data_node)
+        entry = self._key2entry.get(key)
+        if entry is not None and (self._by_content or entry[0] is data_node):
+            self._key2entry.move_to_end(key)
+            self.hits += 1
+            fields = entry[1]
+        else:
+            self.misses += 1
+            fields = {}
+            extract(fields)
+            # Holding the data node keeps its id from being reused by another object.
+            self._key2entry[key] = (None if self._by_content else data_node, fields)
+            if len(self._key2entry) > self.max_size:
+                self._key2entry.popitem(last=False)
+        for field, value in fields.items():
+            res[field] = list(value) if isinstance(value, list) else value  # A fresh list for each row, as extracted.
+
+    @staticmethod
+    def create(memo: Optional[str], memo_size: int) -> Optional["SubtreeMemo"]:
+        """
+        :param memo: None, 'id' or 'content'.
+        """
+        if memo is None:
+            return None
+        if memo not in ("id", "content"):
+            raise ValueError(f"Unsupported memo mode '{memo}'!")
+        return SubtreeMemo(memo_size, memo == "content")
+
+
+class MappingTreeCache:
+    """
+    LRU cache of compiled mapping trees and their generated extractors. A config element is keyed by the hash of its
+    canonical XML, a config file by its path and mtime. Compiled trees are read-only, so they're shared by extractors.
+    """
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._key2entry: collections.OrderedDict = collections.OrderedDict()  # key: [mapping, generated function]
+        self._lock = threading.Lock()
+
+    def get(self, config: Union[XmlElement, XmlDocument, str],
+            compiled: bool = False) -> Tuple[MappingTreeNode, Optional[Callable[..., None]]]:
+        """
+        :param config: Config element, document or file path.
+        :param compiled: Generate the extractor function too, see 'ExtractorCodeGenerator'.
+        :return: (mapping tree, generated function or None if not 'compiled')
+        """
+        key = self._key_of(config)
+        with self._lock:
+            entry = self._key2entry.get(key)
+            if entry is not None:
+                self._key2entry.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is None:
+            entry = [MappingTree.compile(_config_root(config)), None]
+            with self._lock:
+                if isinstance(config, str):  # Drop entries of older versions of the file.
+                    for stale_key in [k for k in self._key2entry if k[:2] == key[:2]]:
+                        del self._key2entry[stale_key]
+                self._key2entry[key] = entry
+                while len(self._key2entry) > self.max_size:
+                    self._key2entry.popitem(last=False)
+        if compiled and entry[1] is None:
+            entry[1] = ExtractorCodeGenerator(entry[0]).generate()
+        return entry[0], entry[1] if compiled else None
+
+    def invalidate(self, config: Union[XmlElement, XmlDocument, str] = None):
+        """
+        Drop the entry of 'config', or all entries if 'config' is None.
+        """
+        with self._lock:
+            if config is None:
+                self._key2entry.clear()
+            elif isinstance(config, str):
+                path = os.path.abspath(config)
+                for key in [k for k in self._key2entry if k[:2] == ("file", path)]:
+                    del self._key2entry[key]
+            else:
+                self._key2entry.pop(self._key_of(config), None)
+
+    def __len__(self):
+        return len(self._key2entry)
+
+    @staticmethod
+    def _key_of(config: Union[XmlElement, XmlDocument, str]) -> tuple:
+        if isinstance(config, str):
+            stat = os.stat(config)
+            return "file", os.path.abspath(config), stat.st_mtime_ns, stat.st_size
+        canonical = etree.tostring(_config_root(config), method="c14n", with_comments=False)
+        return "xml", hashlib.sha1(canonical).hexdigest()
+
+
+def _config_root(config: Union[XmlElement, XmlDocument, str]) -> XmlElement:
+    """Root element of a config element, document or file path."""
+    if isinstance(config, str):
+        config = etree.parse(config)
+    if isinstance(config, XmlDocument):
+        config = config.getroot()
+    return config
+
+
 class TreeExtractor:
     """
     Extract data tree to flat dict.
     """
-    def __init__(self, config: XmlElement):
-        self._mapping = MappingTree.compile(config)
+    cache = MappingTreeCache()  # Shared by all extractors of the process.
+
+    def __init__(self, config: Union[XmlElement, XmlDocument, str], compiled: bool = False, cached: bool = True):
+        """
+        :param config: Config element, document or file path.
+        :param compiled: Generate a specialized python function for the mapping tree instead of interpreting the tree
+            for each item. See 'ExtractorCodeGenerator'.
+        :param cached: Reuse the compiled mapping tree of an identical config from 'TreeExtractor.cache'.
+        """
+        if cached:
+            self._mapping, self._compiled = TreeExtractor.cache.get(config, compiled)
+        else:
+            self._mapping = MappingTree.compile(_config_root(config))
+            self._compiled = ExtractorCodeGenerator(self._mapping).generate() if compiled else None
 
-    def extract_items(self, items: List[Any]) -> List[Dict[str, Any]]:
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_compiled"] = self._compiled is not None  # Generated code isn't picklable, generate again.
+        return state
+
+    def __setstate__(self, state):
+        compiled = state.pop("_compiled")
+        self.__dict__.update(state)
+        self._compiled = ExtractorCodeGenerator(self._mapping).generate() if compiled else None
+
+    def extract_items(self, items: List[Any], processes: int = 0, chunk_size: int = 1000, memo: str = None,
+                      memo_size: int = 4096) -> List[Dict[str, Any]]:
         """
         Extract a list of items.
+        :param processes: Extract in a pool of worker processes if > 0. See 'iter_extract'.
+        :param chunk_size: Number of items sent to a worker process at a time.
+        :param memo: Memoize subtree results within the batch, see 'SubtreeMemo'. 'id': Key data nodes by identity.
+            'content': Key data nodes by JSON content. None: No memo.
+        :param memo_size: Max number of memoized subtree results.
+        :raise: The error of the first failed item, the same as the serial extraction when 'processes' > 0.
         """
-        rows = [self.extract_item(item) for item in items]
+        self._check_batch_args(processes, chunk_size)
+        if processes > 0:
+            try:
+                return list(self.iter_extract(items, processes, chunk_size, memo=memo, memo_size=memo_size))
+            except ExtractionError as e:
+                raise e.error
+        subtree_memo = SubtreeMemo.create(memo, memo_size)
+        rows = [self.extract_item(item, subtree_memo) for item in items]
         return rows
 
-    def extract_item(self, item: Any) -> Dict[str, Any]:
+    def iter_extract(self, items: Iterable[Any], processes: int = 0, chunk_size: int = 1000, errors: str = "raise",
+                     memo: str = None, memo_size: int = 4096) -> Iterator[Union[Dict[str, Any], ExtractionError]]:
+        """
+        Extract items lazily. Rows are yielded in the order of items.
+        :param items: Any iterable, consumed lazily.
+        :param processes: Extract in a pool of worker processes if > 0. The extractor is shipped to each worker once,
+            items are sent in chunks. Custom engines must be picklable.
+        :param chunk_size: Number of items sent to a worker process at a time.
+        :param errors: 'raise': Raise an 'ExtractionError' for the first failed item.
+            'yield': Yield the 'ExtractionError' in place of the row and go on.
+        :param memo: See 'extract_items'. Each worker process keeps its own memo for a chunk.
+        :param memo_size: See 'extract_items'.
+        """
+        if errors not in ("raise", "yield"):
+            raise ValueError(f"Unsupported errors mode '{errors}'!")
+        self._check_batch_args(processes, chunk_size)
+        SubtreeMemo.create(memo, memo_size)  # Validate.
+        if processes > 0:
+            results = self._iter_extract_parallel(items, processes, chunk_size, memo, memo_size)
+        else:
+            subtree_memo = SubtreeMemo.create(memo, memo_size)
+            results = (self._extract_or_error(i, item, subtree_memo) for i, item in enumerate(items))
+        for res in results:
+            if isinstance(res, ExtractionError) and errors == "raise":
+                raise res from res.error
+            yield res
+
+    @staticmethod
+    def _check_batch_args(processes: int, chunk_size: int):
+        if processes < 0:
+            raise ValueError(f"Invalid processes '{processes}'!")
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk_size '{chunk_size}', at least 1 item is sent at a time!")
+
+    def _iter_extract_parallel(self, items: Iterable[Any], processes: int, chunk_size: int, memo: Optional[str],
+                               memo_size: int):
+        pool = ProcessPoolExecutor(processes, initializer=_init_extraction_worker, initargs=(self,))
+        try:
+            pending = collections.deque()  # Futures of chunks in order, at most 2 chunks per worker in flight.
+            iter_items = iter(items)
+            start = 0
+            while True:
+                chunk = list(islice(iter_items, chunk_size))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_extract_chunk, start, chunk, memo, memo_size))
+                start += len(chunk)
+                if len(pending) >= 2 * processes:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _extract_or_error(self, index: int, item: Any,
+                          memo: Optional[SubtreeMemo]) -> Union[Dict[str, Any], ExtractionError]:
+        try:
+            return self.extract_item(item, memo)
+        except Exception as e:
+            return ExtractionError(index, e)
+
+    def extract_item(self, item: Any, memo: SubtreeMemo = None) -> Dict[str, Any]:
         """
         Extract a single data item.
+        :param memo: Subtree memo shared by items of a batch.
         """
         flat_dict: Dict[str, List] = {}
-        self._r_extract(self._mapping, item, flat_dict)
+        self._extract_into(item, flat_dict, memo)
         return flat_dict
 
-    def _r_extract(self, config_node: MappingTreeNode, data_node, res: dict):
+    def extract_columns(self, items: Iterable[Any], numpy: bool = False) -> Dict[str, Any]:
+        """
+        Extract items straight into per-field columns, no row dict is kept.
+        A column is an 'array.array'('q' for int, 'd' for float) while all of its values are of the type of its first
+        value, otherwise a list. None is kept as None, so a column with None is always a list. A field absent from a
+        row is None in that row.
+        :param numpy: Convert columns to numpy arrays. Typed arrays are wrapped without copy, lists become arrays of
+            dtype 'object'.
+        :return: {field: column}, fields in order of appearance.
+        """
+        columns: Dict[str, _ColumnBuffer] = {}
+        res = {}  # Reused for every item.
+        n_rows = 0
+        for item in items:
+            res.clear()
+            self._extract_into(item, res)
+            for field, value in res.items():
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = _ColumnBuffer(n_rows)
+                column.append(value)
+            n_rows += 1
+            if len(res) != len(columns):  # Fill absent fields.
+                for column in columns.values():
+                    if len(column.values) < n_rows:
+                        column.append(None)
+        if not numpy:
+            return {field: column.values for field, column in columns.items()}
+        return {field: column.to_numpy() for field, column in columns.items()}
+
+    def iter_extract_json(self, source: Union[str, BinaryIO], fmt: str = None, processes: int = 0,
+                          chunk_size: int = 1000, errors: str = "raise"):
+        """
+        Extract records of a JSON Lines file or a top-level JSON array lazily, one record decoded at a time.
+        See 'iter_json_records' and 'iter_extract'.
+        """
+        records = iter_json_records(source, fmt)
+        try:
+            yield from self.iter_extract(records, processes, chunk_size, errors)
+        finally:
+            records.close()
+
+    def extract_json2file(self, source: Union[str, BinaryIO], sink: Union[str, TextIO], sink_format: str = None,
+                          fmt: str = None, processes: int = 0, chunk_size: int = 1000,
+                          fieldnames: List[str] = None) -> int:
+        """
+        Extract records of a JSON Lines file or a top-level JSON array, write rows to 'sink' as they come.
+        :param sink: Output file path or text stream.
+        :param sink_format: 'jsonl' or 'csv'. Detected by the extension of 'sink' path if None, 'jsonl' by default.
+        :param fmt: Format of 'source', see 'iter_json_records'.
+        :param fieldnames: CSV columns. None: Every field of the mapping, see 'fields'. Fields absent from a row are
+            written empty.
+        :return: Number of rows written.
+        """
+        if sink_format is None:
+            sink_format = "csv" if isinstance(sink, str) and sink.lower().endswith(".csv") else "jsonl"
+        if sink_format not in ("jsonl", "csv"):
+            raise NotImplementedError(f"Unsupported sink format '{sink_format}'!")
+        if isinstance(sink, str):
+            with open(sink, "w", encoding="utf-8", newline="") as f:
+                return self.extract_json2file(source, f, sink_format, fmt, processes, chunk_size, fieldnames)
+        n_rows = 0
+        writer = None
+        for row in self.iter_extract_json(source, fmt, processes, chunk_size):
+            if sink_format == "jsonl":
+                sink.write(json.dumps(row, ensure_ascii=False))
+                sink.write("\n")
+            else:
+                if writer is None:
+                    writer = csv.DictWriter(sink, fieldnames=self.fields() if fieldnames is None else fieldnames)
+                    writer.writeheader()
+                writer.writerow(row)
+            n_rows += 1
+        return n_rows
+
+    def fields(self) -> List[str]:
+        """
+        Every field a row may have, in order of the mapping. Fields under an optional 'rows' are absent from the rows
+        it matches nothing for.
+        """
+        fields = []
+        nodes = [self._mapping]
+        while nodes:
+            node = nodes.pop()
+            if node.tag in ("table", "rows", "items"):  # Fields of the children are merged into the row.
+                nodes.extend(reversed(node.children))
+            elif node.field not in fields:
+                fields.append(node.field)
+        return fields
+
+    def extract_records(self, items: Iterable[Any]):
+        """
+        Extract items to a numpy record array. See 'extract_columns'.
+        :rtype: numpy.recarray
+        """
+        import numpy as np
+        columns = self.extract_columns(items, numpy=True)
+        if not columns:
+            return np.rec.array(np.empty(0, dtype=[]))
+        return np.rec.fromarrays(list(columns.values()), names=list(columns.keys()))
+
+    def _extract_into(self, item: Any, res: dict, memo: SubtreeMemo = None):
+        if self._compiled is not None:
+            self._compiled(item, res, None, memo)
+        else:
+            self._r_extract(self._mapping, item, res, None, memo)
+
+    def _r_extract(self, config_node: MappingTreeNode, data_node, res: dict, parsed: list = None,
+                   memo: SubtreeMemo = None):
+        """
+        :param parsed: Result of parsing 'data_node' with the path of 'config_node', if parsed in a batch already.
+        """
+        if memo is not None and data_node is not None and config_node.tag in SubtreeMemo.TAGS:
+            memo.run(config_node, data_node, res,
+                     lambda fields: self._r_extract_node(config_node, data_node, fields, parsed, memo))
+        else:
+            self._r_extract_node(config_node, data_node, res, parsed, memo)
+
+    def _r_extract_node(self, config_node: MappingTreeNode, data_node, res: dict, parsed: Optional[list],
+                        memo: Optional[SubtreeMemo]):
         # 1. Check input and prepare data.
         extractor = config_node.engine
-        is_optional = config_node.get_attr("optional", False)
+        is_optional = config_node.optional
         if data_node is None and not is_optional:
             raise RuntimeError(f"{config_node}: Input data for non-optional '{config_node.tag}' shouldn't be 'None'.")
-        path = config_node.get_attr("path", None)
-        if path:
-            extracted_data_nodes = [] if data_node is None else extractor.parse(data_node, path, config_node)
+        path = config_node.path
+        if parsed is not None:
+            extracted_data_nodes = parsed
+        elif path:
+            extracted_data_nodes = [] if data_node is None else extractor.parse(data_node, config_node.expr, config_node)
         else:
             extracted_data_nodes = [] if data_node is None else [data_node]
         extracted_data_nodes = self._remove_empty_str(extracted_data_nodes)
         tag = config_node.tag
-        field = config_node.get_attr("field", "value")
+        field = config_node.field
         ele_children = config_node.children
         # 2. Parse.
         if tag == "table":
             if len(ele_children) > 1:
                 raise NotImplementedError()
-            for child_data_node in extracted_data_nodes:
-                for child_conf in ele_children:
-                    self._r_extract(child_conf, child_data_node, res)
+            batches = [self._parse_batch(child_conf, extracted_data_nodes) for child_conf in ele_children]
+            for i, child_data_node in enumerate(extracted_data_nodes):
+                for child_conf, batch in zip(ele_children, batches):
+                    self._r_extract(child_conf, child_data_node, res, None if batch is None else batch[i], memo)
         elif tag == "rows":
             if len(extracted_data_nodes) == 0 and not is_optional:
                 raise RuntimeError(f"{config_node}: Path of non-optional 'rows' extracted nothing.")
-            for child_data_node in extracted_data_nodes:  # 1 row per child_data_node.
+            batches = [self._parse_batch(child_conf, extracted_data_nodes) for child_conf in ele_children]
+            for i, child_data_node in enumerate(extracted_data_nodes):  # 1 row per child_data_node.
                 field2data_item = {}  # 1 row.
-                for child_conf in ele_children:
-                    self._r_extract(child_conf, child_data_node, field2data_item)
+                for child_conf, batch in zip(ele_children, batches):
+                    self._r_extract(child_conf, child_data_node, field2data_item,
+                                    None if batch is None else batch[i], memo)
                 # Merge with other 'rows' node.
                 for field, data_item in field2data_item.items():
                     if field in res:
@@ -189,7 +1098,7 @@ class TreeExtractor:
                 extracted_data_nodes = [None]
             field2child_data_item = {}
             for child_conf in ele_children:
-                self._r_extract(child_conf, extracted_data_nodes[0], field2child_data_item)
+                self._r_extract(child_conf, extracted_data_nodes[0], field2child_data_item, None, memo)
             # Update final result.
             res.update(field2child_data_item)
         elif tag == "itemAny":  # Returns {field: data_item}
@@ -204,7 +1113,7 @@ class TreeExtractor:
                 for child_data_node in extracted_data_nodes:
                     for child_conf in ele_children:
                         field2child_data_item = {}
-                        self._r_extract(child_conf, child_data_node, field2child_data_item)
+                        self._r_extract(child_conf, child_data_node, field2child_data_item, None, memo)
                         child_res_value = field2child_data_item["value"]
                         if child_res_value:  # Not none.
                             res[field] = child_res_value
@@ -226,7 +1135,7 @@ class TreeExtractor:
                 else:  # Run child extractors.
                     for child_conf in ele_children:
                         field2child_data_item = {}
-                        self._r_extract(child_conf, child_data_node, field2child_data_item)
+                        self._r_extract(child_conf, child_data_node, field2child_data_item, None, memo)
                         child_data_item = next(iter(field2child_data_item.values()))
                         if child_data_item is not None:
                             items.append(child_data_item)
@@ -252,7 +1161,7 @@ class TreeExtractor:
                 else:
                     for child_conf_node in ele_children:
                         field2child_data_item = {}
-                        self._r_extract(child_conf_node, child_data_node, field2child_data_item)
+                        self._r_extract(child_conf_node, child_data_node, field2child_data_item, None, memo)
                         child_data_item = next(iter(field2child_data_item.values()))
                         if child_data_item is not None:
                             data_strs.append(str(child_data_item))
@@ -265,9 +1174,9 @@ class TreeExtractor:
                 if is_optional:
                     res[field] = None
                 else:
-                    raise f"{config_node}: Non-optional itemJoin should return 1 non-empty string."
+                    raise RuntimeError(f"{config_node}: Non-optional itemJoin should return 1 non-empty string.")
             else:
-                delimiter = config_node.get_attr("delimiter", ",")
+                delimiter = config_node.delimiter
                 res[field] = delimiter.join(x.strip() for x in filtered)
         elif tag == "item":
             if len(extracted_data_nodes) > 1:
@@ -286,6 +1195,22 @@ class TreeExtractor:
         else:
             raise NotImplementedError(f"Unsupported config node type '{config_node.tag}'")
 
+    @staticmethod
+    def _parse_batch(config_node: MappingTreeNode, data_nodes: list) -> Optional[List[Optional[list]]]:
+        """
+        Parse sibling data nodes with the path of 'config_node' by 'ExtractionEngine.parse_batch'.
+        :return: Parsed result of each data node, None for a None data node. None if there's nothing to batch or the
+            batch failed, data nodes are then parsed one by one so that errors are raised in the original order.
+        """
+        if config_node.expr is None or len(data_nodes) < 2:
+            return None
+        batch = [x for x in data_nodes if x is not None]
+        try:
+            parsed = iter(config_node.engine.parse_batch(batch, config_node.expr, config_node))
+        except Exception:
+            return None
+        return [None if x is None else next(parsed) for x in data_nodes]
+
     @staticmethod
     def _is_basic_data(data_item):
         return isinstance(data_item, (str, int, float, type(None)))
@@ -303,3 +1228,115 @@ class TreeExtractor:
                     continue
             res.append(x)
         return res
+
+
+def iter_json_records(source: Union[str, BinaryIO], fmt: str = None, buffer_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Decode records from JSON Lines or a top-level JSON array incrementally, memory use is bounded by the largest
+    record instead of the input size.
+    :param source: File path or binary stream.
+    :param fmt: 'jsonl' or 'array'. Detected if None: '.jsonl'/'.ndjson' paths are JSON Lines, otherwise an input
+        starting with '[' is a JSON array.
+    :param buffer_size: Bytes read at a time.
+    """
+    if isinstance(source, str):
+        if fmt is None and source.lower().endswith((".jsonl", ".ndjson")):
+            fmt = "jsonl"
+        with open(source, "rb") as f:
+            yield from iter_json_records(f, fmt, buffer_size)
+        return
+    if fmt is None:
+        if not hasattr(source, "peek"):
+            source = io.BufferedReader(source)
+        if source.peek(3)[:3] == codecs.BOM_UTF8:  # Detect by the char after BOM.
+            source.read(3)
+        head = source.peek(1)
+        while head[:1].isspace():  # Skip leading whitespaces to find the first char.
+            source.read(1)
+            head = source.peek(1)
+        fmt = "array" if head[:1] == b"[" else "jsonl"
+    if fmt == "jsonl":
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == "array":
+        yield from _iter_json_array(source, buffer_size)
+    else:
+        raise NotImplementedError(f"Unsupported JSON records format '{fmt}'!")
+
+
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+def _iter_json_array(stream: BinaryIO, buffer_size: int) -> Iterator[Any]:
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill(min_size: int) -> bool:
+        """Read more text. Returns False at the end of stream."""
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        buf = buf[pos:]  # Drop consumed text.
+        pos = 0
+        chunk = stream.read(max(buffer_size, min_size))
+        eof = not chunk
+        buf += text_decoder.decode(chunk, final=eof)
+        return True
+
+    def next_char() -> str:
+        """Skip whitespaces and return the next char, '' at the end of stream."""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or not fill(0):
+                return buf[pos:pos + 1]
+
+    if next_char() != "[":
+        raise ValueError("JSON array expected!")
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        next_char()
+        size = len(buf) - pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A value may be truncated by the buffer end, e.g. number '12.|5', until a non-number char follows.
+                following = end
+                while following < len(buf) and (buf[following].isspace() or buf[following] in _NUMBER_CHARS):
+                    following += 1
+                if following < len(buf) or eof:
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            size *= 2  # Read at least as much as buffered, re-decoding a huge record stays linear.
+            fill(size)
+        pos = end
+        yield value
+        c = next_char()
+        pos += 1
+        if c == "]":
+            return
+        if c != ",":
+            raise ValueError(f"JSON array: ',' or ']' expected at the end of a record, got '{c}'!")
+
+
+_worker_extractor: Optional[TreeExtractor] = None  # Extractor of current worker process.
+
+
+def _init_extraction_worker(extractor: TreeExtractor):
+    global _worker_extractor
+    _worker_extractor = extractor
+
+
+def _extract_chunk(start: int, items: List[Any], memo: Optional[str],
+                   memo_size: int) -> List[Union[Dict[str, Any], ExtractionError]]:
+    subtree_memo = SubtreeMemo.create(memo, memo_size)
+    return [_worker_extractor._extract_or_error(start + i, item, subtree_memo) for i, item in enumerate(items)]
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# @Time         : 10:12 2026/10/16
+# @Author       : Chris
+# @Description  :
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+import yaml
+from lxml import etree
+from .. import config
+from ..config import AsyncCascadeConfig, CascadeConfig, ConfigWatcher, FileCache, SimpleConfig, XmlConfig
+
+
+class CascadeConfigTest(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self._tmp_dir.name
+        self._write("default/sqls/a.sql", "select {x} from {table} -- {site_id}")
+        self._write("default/sqls/common.json", json.dumps({"x": "x0", "table": "t0"}))
+        self._write("site/sqls/a.sql.json", json.dumps({"x": "x1"}))
+        self._write("default/conf.json", json.dumps({"a": 1, "b": "$site_id"}))
+        self._write("site/conf.json", json.dumps({"a": 2}))
+        self.file_cache = FileCache()
+        self.config = self._config()
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_read(self):
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+        assert self.config.read_text("sqls/a.sql", table="t1") == "select x1 from t1 -- site"
+        self.config["table"] = "t2"
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t2 -- site"
+        assert self.config.read_json("conf.json") == {"a": 2}
+        assert self.config.read_json_fortified("conf.json") == {"a": 2, "b": "$site_id"}
+        self._write("default/c.json", json.dumps({"db": {"host": "h"}}))
+        self.config.read_json_fortified("c.json")["db"]["host"] = "mutated"
+        self.file_cache.read_json(f"{self.root}/default/c.json")["db"]["host"] = "mutated"
+        assert self.config.read_json_fortified("c.json") == {"db": {"host": "h"}}
+        assert self.config.read_json_fortified("c.json", shared=True)["db"] is \
+               self.file_cache.read_json(f"{self.root}/default/c.json", shared=True)["db"]
+        with self.assertRaises(FileNotFoundError):
+            self.config.read_text("sqls/missing.sql")
+
+    def test_file_cache(self):
+        self.config.read_text("sqls/a.sql")
+        misses = self.file_cache.misses
+        self.config.read_text("sqls/a.sql")
+        assert self.file_cache.misses == misses  # Missing files are cached too.
+        self._write("site/sqls/a.sql", "select {x} from {table}, t3")
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t0, t3"
+        self.file_cache.ttl = 3600
+        self._write("site/sqls/a.sql", "select {x} from {table}, t4")
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t0, t3"  # Trusted within TTL.
+        self.file_cache.invalidate(f"{self.root}/site/sqls/a.sql")
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t0, t4"
+
+    def test_render_memo(self):
+        self.config.read_text("sqls/a.sql")
+        template = self.file_cache.read_parsed(f"{self.root}/default/sqls/a.sql", "template", None)
+        assert len(template._memo) == 1
+        assert self.config.read_text("sqls/a.sql", x=True) == "select True from t0 -- site"
+        assert self.config.read_text("sqls/a.sql", x=1) == "select 1 from t0 -- site"
+        assert self.config.read_text("sqls/a.sql", x=[1]) == "select [1] from t0 -- site"
+        assert self.config.read_text("sqls/a.sql", x=(1,)) == "select (1,) from t0 -- site"
+        self.config["table"] = "t1"
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t1 -- site"
+
+        class Ids:
+            def __init__(self, *ids):
+                self.ids = list(ids)
+
+            def __format__(self, format_spec):
+                return f"id in ({', '.join(map(str, self.ids))})"
+
+        ids = Ids(1)
+        assert self.config.read_text("sqls/a.sql", x=ids) == "select id in (1) from t1 -- site"
+        ids.ids.append(2)  # Not memoized by identity.
+        assert self.config.read_text("sqls/a.sql", x=ids) == "select id in (1, 2) from t1 -- site"
+        template.max_memo_size = 4
+        template._memo.clear()
+        with ThreadPoolExecutor(8) as executor:  # Concurrent inserts and evictions.
+            assert list(executor.map(lambda x: template.render({"x": x % 50, "table": "t", "site_id": "s"}),
+                                     range(2000))) == [f"select {x % 50} from t -- s" for x in range(2000)]
+        assert len(template._memo) <= 4
+        with mock.patch.object(config._datetime, "date", mock.Mock(wraps=config._datetime.date)) as date:
+            date.today.return_value = config._datetime.date(2026, 10, 17)
+            self._write("default/sqls/b.sql", "{today}")
+            assert self.config.read_text("sqls/b.sql") == "20261017"
+            date.today.return_value = config._datetime.date(2026, 10, 18)
+            assert self.config.read_text("sqls/b.sql") == "20261018"
+
+    def test_index(self):
+        self._write("default/sqls/.hidden.sql", "")
+        config = self._config(indexed=True)
+        for c in (self.config, config):
+            assert c.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+            assert c.read_json_fortified("conf.json") == {"a": 2, "b": "$site_id"}
+            assert c.detect_abs_path("conf.json") == f"{self.root}/default/conf.json"
+        assert sorted(config.list_dir("sqls")) == sorted(self.config.list_dir("sqls"))
+        assert sorted(config.list_dir("sqls", ".*")) == sorted(self.config.list_dir("sqls", ".*")) == [
+            "sqls/.hidden.sql"]
+        with mock.patch("os.path.exists", side_effect=AssertionError):
+            assert config.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+        self._write("site/sqls/common.json", json.dumps({"table": "t5"}))
+        assert config.read_text("sqls/a.sql") == "select x1 from t0 -- site"  # Not seen until updated.
+        assert config.index.poll()
+        assert not config.index.poll()
+        assert config.read_text("sqls/a.sql") == "select x1 from t5 -- site"
+        os.remove(f"{self.root}/site/sqls/common.json")
+        config.index.refresh()
+        assert config.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+        with self.assertRaises(FileNotFoundError):
+            config.detect_abs_path("sqls/missing.sql")
+
+    def test_watcher(self):
+        self.file_cache.ttl = 3600
+        watcher = ConfigWatcher(self.config, interval=.01)
+        changes = []
+        watcher.subscribe("sqls/a.sql", changes.append)
+        watcher.subscribe("sqls/b.sql", changes.append)
+        watcher.subscribe("conf.json", changes.append)
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+        assert watcher.check() == []
+        self._write("site/sqls/a.sql.json", json.dumps({"x": "x2"}))
+        assert watcher.check() == ["sqls/a.sql.json"]
+        assert changes == ["sqls/a.sql"]
+        assert self.config.read_text("sqls/a.sql") == "select x2 from t0 -- site"
+        self._write("default/sqls/common.json", json.dumps({"x": "x0", "table": "t1"}))
+        assert watcher.check() == ["sqls/common.json"]
+        assert changes == ["sqls/a.sql", "sqls/a.sql", "sqls/b.sql"]
+        self._write("site/sqls/b.sql", "b")  # Never read.
+        assert watcher.check() == ["sqls/b.sql"]
+        assert changes[-1] == "sqls/b.sql" and len(changes) == 4
+        with watcher:
+            self._write("site/conf.json", json.dumps({"a": 3}))
+            for _ in range(100):
+                if len(changes) == 5:
+                    break
+                time.sleep(.05)
+        assert changes[-1] == "conf.json"
+        assert watcher.last_error is None
+
+    def test_watcher_after_read(self):
+        assert self.file_cache.ttl is None
+        watcher = ConfigWatcher(self.config)
+        changes = []
+        watcher.subscribe("sqls/a.sql", changes.append)
+        assert self.config.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+        assert watcher.check() == []
+        self._write("site/sqls/a.sql.json", json.dumps({"x": "x22"}))
+        assert self.config.read_text("sqls/a.sql") == "select x22 from t0 -- site"  # Refreshed before the poll.
+        assert watcher.check() == ["sqls/a.sql.json"]
+        assert changes == ["sqls/a.sql"]
+        assert watcher.check() == []
+
+    def test_xml_cache(self):
+        XmlConfig.invalidate()
+        self._write("default/xml/base.xml", '<root><a x="1"><b/></a></root>')
+        self._write("default/xml/main.xml", '<root><import file="base.xml" as="base"/>'
+                                            '<c _extends_="base::/root/a"/></root>')
+        with mock.patch.object(config.etree, "parse", wraps=etree.parse) as parse:
+            doc = self.config.read_xml("xml/main.xml")
+            assert etree.tostring(doc) == b'<root><c x="1"><b/></c></root>'
+            assert parse.call_count == 2
+            doc.getroot().clear()  # Copies are independent.
+            assert etree.tostring(self.config.read_xml("xml/main.xml")) == b'<root><c x="1"><b/></c></root>'
+            assert self.config.read_xml("xml/main.xml", shared=True) is \
+                   self.config.read_xml("xml/main.xml", shared=True)
+            assert parse.call_count == 2
+            self._write("default/xml/main.xml", '<root><import file="base.xml" as="base"/>'
+                                                '<d _extends_="base::/root/a"/></root>')
+            assert etree.tostring(self.config.read_xml("xml/main.xml")) == b'<root><d x="1"><b/></d></root>'
+            assert parse.call_count == 3  # Only the changed file.
+            self._write("default/xml/base.xml", '<root><a x="2"/></root>')
+            assert etree.tostring(self.config.read_xml("xml/main.xml")) == b'<root><d x="2"/></root>'
+            assert parse.call_count == 5  # The changed file and its dependent.
+            assert etree.tostring(XmlConfig(self.config, cached=False).load("xml/main.xml")) == \
+                   b'<root><d x="2"/></root>'
+            assert parse.call_count == 7
+
+    def test_xml_select(self):
+        doc = etree.ElementTree(etree.fromstring(
+            '<root id="r"><a id="1" name="x"/><b id="1"><a id="2"/><!-- c --><a id="1"/></b><c name=\'y"\'/></root>'))
+        xml_conf = XmlConfig(self.config)
+        for xpath in ("//a[@id='1']", '//a[@id="2"]', "//*[@id='1']", "//*[@id='r']", "//a[@id='3']",
+                      "//b[@name='x']", "//*[@name='y\"']", "/root/a[@id='1']", "//a[@id='1']/@name"):
+            assert xml_conf._select(doc, xpath) == doc.xpath(xpath), xpath
+        assert len(xml_conf._doc2index) == 1
+
+    def test_snapshot(self):
+        self._write("default/xml/main.xml", '<root><a id="1" x="1"/><b _extends_="self:://a[@id=\'1\']"/></root>')
+        self._write("default/sqls/top.sql", "{top}")
+        snapshot_path = f"{self.root}/snapshot.pkl"
+        self.config.freeze(snapshot_path)
+        self._write("default/conf.json", json.dumps({"a": 3}))
+        XmlConfig.invalidate()
+        self.file_cache = FileCache()
+        config_ = self._config()
+        assert config_.load_snapshot(snapshot_path) > 0
+        with mock.patch.object(config.etree, "parse", side_effect=AssertionError):
+            assert etree.tostring(config_.read_xml("xml/main.xml")) == b'<root><a id="1" x="1"/><b id="1" x="1"/></root>'
+        assert config_.read_text("sqls/a.sql") == "select x1 from t0 -- site"
+        assert config_.read_text("sqls/top.sql", top=1) == "1"
+        assert self.file_cache.misses == 0
+        assert config_.read_json_fortified("conf.json") == {"a": 2}  # Changed files are read again.
+        assert self.file_cache.misses == 1
+        assert CascadeConfig("other", file_cache=FileCache()).load_snapshot(snapshot_path) == 0
+
+    def test_yaml(self):
+        self._write("default/a.yml", "a: {site_id}\nb: !!python/name:os.system\n")
+        with self.assertRaises(yaml.YAMLError):  # Safe.
+            self.config.read_yaml("a.yml")
+        self._write("default/a.yml", "a: {site_id}\nb: 2020-01-01\n")
+        obj = self.config.read_yaml("a.yml")
+        assert obj == yaml.safe_load("a: site\nb: 2020-01-01\n")
+        obj["a"] = None
+        assert self.config.read_yaml("a.yml", shared=True) is self.config.read_yaml("a.yml", shared=True)
+        assert self.config.read_yaml("a.yml") == {"a": "site", "b": obj["b"]}
+        simple_config = SimpleConfig(self.root, file_cache=self.file_cache)
+        assert simple_config.read_yaml("default/a.yml") == {"a": {"site_id": None}, "b": obj["b"]}
+        misses = self.file_cache.misses
+        assert simple_config.read_yaml("default/a.yml", shared=True) is \
+               simple_config.read_yaml("default/a.yml", shared=True)
+        assert self.file_cache.misses == misses
+        with self.assertRaises(FileNotFoundError):
+            simple_config.read_yaml("missing.yml")
+
+    def test_async(self):
+        read_json = self.config.read_json
+
+        def slow_read_json(rel_path):
+            time.sleep(.05)
+            return read_json(rel_path)
+
+        async def read_all(async_config: AsyncCascadeConfig):
+            async with async_config:
+                return await asyncio.gather(*[async_config.read_json("conf.json") for _ in range(5)],
+                                            async_config.read_text("sqls/a.sql", table="t1"),
+                                            async_config.read_text("sqls/a.sql", table=[]),
+                                            async_config.read_xml("xml/a.xml"))
+
+        async def exit_while_loading(async_config: AsyncCascadeConfig) -> int:
+            ticks = []
+
+            async def tick():
+                while True:
+                    ticks.append(None)
+                    await asyncio.sleep(.01)
+
+            ticker = asyncio.ensure_future(tick())
+            async with async_config:
+                load = asyncio.ensure_future(async_config.read_json("conf.json"))
+                await asyncio.sleep(0)  # Load started.
+                ticks.clear()
+            ticker.cancel()
+            assert await load == {"a": 2}
+            return len(ticks)
+
+        self._write("default/xml/a.xml", "<root/>")
+        with mock.patch.object(self.config, "read_json", side_effect=slow_read_json) as mock_read_json:
+            results = asyncio.run(read_all(AsyncCascadeConfig(self.config)))
+        assert mock_read_json.call_count == 1  # Coalesced.
+        assert results[:5] == [{"a": 2}] * 5 and results[0] is not results[1]
+        assert results[5:7] == ["select x1 from t1 -- site", "select x1 from [] -- site"]
+        assert etree.tostring(results[7]) == b"<root/>"
+        with mock.patch.object(self.config, "read_json", side_effect=slow_read_json):
+            assert asyncio.run(exit_while_loading(AsyncCascadeConfig(self.config))) > 1  # Loop not blocked.
+
+    def test_read_many(self):
+        self._write("default/a.yml", "a: {site_id}\n")
+        self._write("default/xml/a.xml", "<root/>")
+        rel_paths = ["sqls/a.sql", "conf.json", "a.yml", "xml/a.xml", "sqls/a.sql"]
+        for workers in (0, 2):
+            with mock.patch.object(self.config, "_get_global_side_config_dict",
+                                   wraps=self.config._get_global_side_config_dict) as get_global_side_config_dict, \
+                    mock.patch.object(self.file_cache, "read_json", wraps=self.file_cache.read_json) as read_json:
+                results = self.config.read_many(rel_paths, workers=workers, table="t1")
+            assert get_global_side_config_dict.call_count == 1
+            assert len(read_json.call_args_list) == len({x.args for x in read_json.call_args_list})
+            assert list(results) == rel_paths[:4]
+            assert results["sqls/a.sql"] == "select x1 from t1 -- site"
+            assert results["conf.json"] == {"a": 2}
+            assert results["a.yml"] == {"a": "site"}
+            assert etree.tostring(results["xml/a.xml"]) == b"<root/>"
+        with self.assertRaises(FileNotFoundError):
+            self.config.read_many(["missing.json"])
+
+    def _config(self, **kwargs) -> CascadeConfig:
+        config = CascadeConfig("site", file_cache=self.file_cache, **kwargs)
+        config.root = self.root
+        return config
+
+    def _write(self, rel_path: str, text: str):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
@@ -2,9 +2,22 @@
 # @Time         : 14:51 2022/12/18
 # @Author       : Chris
 # @Description  :
-from unittest import TestCase
+import base64
+import contextlib
+import io
+import json
+import mmap
+import os
+import tempfile
+import threading
+import zipfile
+from unittest import TestCase, mock
+from PIL import Image
+from .. import data
 from ..data import zip_data2bytes, iter_files_from_zip_bytes
 from ..data import zip_coco2bytes, unzip_bytes
+from ..data import zip_coco2stream, zip_data2stream, zip_dir2stream, iter_zip_coco, iter_zip_data, iter_zip_dir
+from ..data import zip_dir2bytes, zip_coco2stream_incremental, ZipReader, iter_files4zip_bytes, unzip_bytes2dir
 from ..data import NestedListFlatter
 
 
@@ -33,6 +46,227 @@ class Test(TestCase):
         unzip_bytes(zip_bytes, "F:/tmp/zip_coco2bytes")
 
 
+class ZipStreamTest(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self._tmp_dir.name
+        os.makedirs(f"{self.root}/img/sub")
+        self.paths = []
+        for i in range(3):
+            path = f"{self.root}/img/sub/{i}.bin" if i else f"{self.root}/img/{i}.bin"
+            with open(path, "wb") as f:
+                f.write(os.urandom(300000 * (i + 1)))
+            self.paths.append(path)
+        self.coco = {"images": [{"id": i, "file_name": x} for i, x in enumerate(self.paths)], "annotations": []}
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_zip_coco(self):
+        zip_bytes = zip_coco2bytes(self.coco)
+        assert self.coco["images"][0]["file_name"] == self.paths[0]  # Not modified.
+        files = self._read_zip(zip_bytes)
+        assert json.loads(files.pop("annotations.json"))["images"][1] == {"id": 1, "file_name": "1.bin"}
+        assert files == {f"images/{os.path.basename(x)}": self._read(x) for x in self.paths}
+        for zip_bytes_ in (self._to_stream(zip_coco2stream, self.coco), b"".join(iter_zip_coco(self.coco, 1000))):
+            assert self._read_zip(zip_bytes_) == self._read_zip(zip_bytes)
+        assert len(list(iter_zip_coco(self.coco, 1000))) > len(self.paths)  # Streamed in chunks.
+
+    def test_zip_data(self):
+        data = [self.paths[0], {"b64": base64.b64encode(b"abc").decode(), "name": "a.txt"}, Image.new("RGB", (4, 4))]
+        files = self._read_zip(zip_data2bytes(data))
+        assert files["0_0.bin"] == self._read(self.paths[0]) and files["1_a.txt"] == b"abc" and len(files) == 3
+        for zip_bytes in (self._to_stream(zip_data2stream, data), b"".join(iter_zip_data(data))):
+            files_ = self._read_zip(zip_bytes)
+            assert files_["0_0.bin"] == files["0_0.bin"] and files_["1_a.txt"] == b"abc" and len(files_) == 3
+
+    def test_zip_dir(self):
+        files = self._read_zip(zip_dir2bytes(self.root))
+        assert files["img/sub/2.bin"] == self._read(self.paths[2]) and "img/sub/" in files
+        for zip_bytes in (self._to_stream(zip_dir2stream, self.root), b"".join(iter_zip_dir(self.root, 1))):
+            assert self._read_zip(zip_bytes) == files
+
+    def test_parallel(self):
+        with open(f"{self.root}/img/text.txt", "wb") as f:
+            f.write(b"abc" * 100000)
+        self.paths.append(f"{self.root}/img/text.txt")
+        self.paths.append(f"{self.root}/img/a.jpg")
+        Image.new("RGB", (64, 64)).save(self.paths[-1])
+        coco = {"images": [{"id": i, "file_name": x} for i, x in enumerate(self.paths)], "annotations": []}
+        files = self._read_zip(zip_coco2bytes(coco))
+        for compression in ("deflate", "store", "auto"):
+            for workers in (0, 1, 4):
+                zip_bytes = zip_coco2bytes(coco, compression, workers)
+                assert self._read_zip(zip_bytes) == files
+                with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+                    assert zf.testzip() is None
+                    assert [x.filename for x in zf.infolist()] == list(files)  # In order.
+                    compress_types = {x.filename: x.compress_type for x in zf.infolist()}
+                if compression == "auto":
+                    assert compress_types["images/a.jpg"] == compress_types["images/0.bin"] == zipfile.ZIP_STORED
+                    assert compress_types["images/text.txt"] == zipfile.ZIP_DEFLATED
+                else:
+                    assert set(compress_types.values()) == {
+                        zipfile.ZIP_DEFLATED if compression == "deflate" else zipfile.ZIP_STORED}
+        assert self._read_zip(b"".join(iter_zip_coco(coco, 1000, "auto", 4))) == files
+        assert self._read_zip(self._to_stream(lambda x, y: zip_dir2stream(x, y, "auto", 2), self.root)) == \
+               self._read_zip(zip_dir2bytes(self.root))
+        with self.assertRaises(NotImplementedError):
+            zip_dir2bytes(self.root, "lzma")
+        with mock.patch.object(data, "_PARALLEL_MAX_SIZE", 100000), \
+                mock.patch.object(data, "_compress_entry", wraps=data._compress_entry) as compress_entry:
+            assert self._read_zip(zip_coco2bytes(coco, "auto", 2)) == files
+        # Larger files aren't read whole by workers.
+        assert sorted(x.args[1] for x in compress_entry.call_args_list if x.args[1] is not None) == \
+               sorted(x for x in self.paths if os.path.getsize(x) <= 100000) != sorted(self.paths)
+
+    def test_zip_reader(self):
+        zip_bytes = zip_dir2bytes(self.root, "store")
+        files = self._read_zip(zip_bytes)
+        zip_path = f"{self.root}/a.zip"
+        with open(zip_path, "wb") as f:
+            f.write(zip_bytes)
+        for source in (zip_path, zip_bytes, memoryview(zip_bytes), bytearray(zip_bytes), io.BytesIO(zip_bytes)):
+            with ZipReader(source) as reader:
+                assert len(reader) == len(files) and list(reader) == list(files) and "img/0.bin" in reader
+                assert dict(reader.iter_files()) == files
+                with reader.open("img/sub/2.bin") as f:
+                    assert f.read(10) == files["img/sub/2.bin"][:10]
+                view = reader.view("img/sub/1.bin")
+                assert view == files["img/sub/1.bin"]
+                if not isinstance(source, io.BytesIO):
+                    assert isinstance(view.obj, (bytes, bytearray, mmap.mmap))  # Not copied.
+                view.release()
+        with ZipReader(zip_dir2bytes(self.root)) as reader:
+            assert reader.view("img/0.bin") == files["img/0.bin"]  # Deflated.
+        with self.assertRaises(KeyError):  # Not hidden by the views alive.
+            with ZipReader(zip_path) as reader:
+                view = reader.view("img/sub/1.bin")
+                raw = reader.read_raw("img/0.bin")
+                reader.view("missing")
+        assert reader._file.closed
+        assert view == files["img/sub/1.bin"] and raw == files["img/0.bin"]
+        del view, raw
+        assert dict(iter_files4zip_bytes(zip_path)) == dict(iter_files_from_zip_bytes(zip_bytes)) == files
+        unzip_bytes2dir(memoryview(zip_bytes), f"{self.root}/out")
+        assert self._read(f"{self.root}/out/img/sub/2.bin") == files["img/sub/2.bin"]
+
+    def test_parallel_extract(self):
+        expected = self._read_tree(self.root)
+        for compression in ("store", "deflate"):
+            zip_bytes = zip_dir2bytes(self.root, compression)
+            zip_path = f"{self._tmp_dir.name}.{compression}.zip"
+            with open(zip_path, "wb") as f:
+                f.write(zip_bytes)
+            try:
+                for source in (zip_bytes, zip_path, io.BytesIO(zip_bytes)):
+                    for workers in (0, 3):
+                        with tempfile.TemporaryDirectory() as output_dir:
+                            unzip_bytes(source if not isinstance(source, io.BytesIO) else io.BytesIO(zip_bytes),
+                                        output_dir, workers)
+                            assert self._read_tree(output_dir) == expected
+                        with tempfile.TemporaryDirectory() as output_dir:
+                            unzip_bytes2dir(source if not isinstance(source, io.BytesIO) else io.BytesIO(zip_bytes),
+                                            output_dir, workers, lambda x: x.filename.startswith("img/sub/"))
+                            assert self._read_tree(output_dir) == {x: y for x, y in expected.items()
+                                                                   if x == "img" or x.startswith("img/sub")}
+            finally:
+                os.remove(zip_path)
+
+    def test_parallel_extract_many(self):
+        zip_io = io.BytesIO()
+        with zipfile.ZipFile(zip_io, "w") as zf:
+            for i in range(1000):
+                zf.writestr(f"d{i % 10}/{i}.txt", str(i) * (i % 50),
+                            zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED)
+        zip_bytes = zip_io.getvalue()
+        zip_path = f"{self.root}/many.zip"
+        with open(zip_path, "wb") as f:
+            f.write(zip_bytes)
+        for source, no_mmap in ((zip_bytes, False), (zip_path, False), (zip_path, True)):
+            with mock.patch.object(data.mmap, "mmap", side_effect=ValueError) if no_mmap else contextlib.nullcontext():
+                reader = ZipReader(source)
+            with reader, tempfile.TemporaryDirectory() as output_dir:
+                with mock.patch.object(data.zipfile, "ZipFile", wraps=zipfile.ZipFile) as zip_file:
+                    reader.extract_all(output_dir, 4)
+                assert zip_file.call_count == 0  # The archive isn't parsed again by each thread.
+                assert self._read(f"{output_dir}/d7/997.txt") == b"997" * 47
+                assert len(os.listdir(f"{output_dir}/d3")) == 100
+        corrupt = bytearray(zip_bytes)
+        offset = corrupt.index(b"990990")  # Stored content.
+        corrupt[offset] = ord("2")
+        with ZipReader(corrupt) as reader, tempfile.TemporaryDirectory() as output_dir:
+            with self.assertRaises(zipfile.BadZipFile):
+                reader.extract_all(output_dir, 2)
+
+    @staticmethod
+    def _read_tree(dir_path: str) -> dict:
+        tree = {}
+        for parent, dir_names, file_names in os.walk(dir_path):
+            for name in dir_names + file_names:
+                path = os.path.join(parent, name)
+                rel_path = os.path.relpath(path, dir_path).replace(os.sep, "/")
+                tree[rel_path] = None if name in dir_names else ZipStreamTest._read(path)
+        return tree
+
+    def test_zip_coco_incremental(self):
+        base_path = f"{self._tmp_dir.name}.base.zip"
+        with open(base_path, "wb") as f:
+            zip_coco2stream(self.coco, f, "auto")
+        try:
+            with open(self.paths[1], "r+b") as f:
+                f.write(b"changed")
+            os.utime(self.paths[1], (0, os.stat(self.paths[1]).st_mtime + 20))  # Same size, DOS time has 2s steps.
+            os.utime(self.paths[2], (0, os.stat(self.paths[2]).st_mtime + 10))  # Touched only.
+            path = f"{self.root}/img/3.bin"
+            with open(path, "wb") as f:
+                f.write(b"new")
+            coco = {"images": [{"id": i, "file_name": x} for i, x in enumerate(self.paths[1:] + [path])],
+                    "annotations": [{"id": 0}]}
+            expected = self._read_zip(zip_coco2bytes(coco))
+            for compare, counts in (("stat", {"copied": 0, "added": 3}), ("crc", {"copied": 1, "added": 2})):
+                for workers in (0, 2):
+                    for base in (base_path, self._read(base_path)):
+                        with io.BytesIO() as stream:
+                            assert zip_coco2stream_incremental(coco, base, stream, "auto", workers, compare) == counts
+                            zip_bytes = stream.getvalue()
+                        assert self._read_zip(zip_bytes) == expected
+                        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+                            assert zf.testzip() is None
+            os.utime(self.paths[2], (0, os.stat(self.paths[2]).st_mtime - 10))
+            with io.BytesIO() as stream:
+                assert zip_coco2stream_incremental(coco, base_path, stream) == {"copied": 1, "added": 2}
+                assert self._read_zip(stream.getvalue()) == expected
+            coco["images"].append({"id": 9, "file_name": f"{self.root}/img/missing.bin"})
+            for workers in (0, 2):
+                with self.assertRaises(FileNotFoundError), io.BytesIO() as stream:
+                    zip_coco2stream_incremental(coco, base_path, stream, workers=workers)
+        finally:
+            os.remove(base_path)
+
+    @staticmethod
+    def _to_stream(zip2stream, data) -> bytes:
+        r, w = os.pipe()  # Non-seekable.
+        with open(w, "wb") as stream, open(r, "rb") as reader, tempfile.TemporaryFile() as f:
+            thread = threading.Thread(target=lambda: f.write(reader.read()))
+            thread.start()
+            zip2stream(data, stream)
+            stream.close()
+            thread.join()
+            f.seek(0)
+            return f.read()
+
+    @staticmethod
+    def _read_zip(zip_bytes: bytes) -> dict:
+        with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+            return {x.filename: zf.read(x) for x in zf.infolist()}
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+
 class NestedListFlatterTest(TestCase):
     def test_flat(self):
         nested, flatted = self._get_data()
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 # @Time         : 9:06 2023/6/11
 # @Author       : Chris
-from unittest import TestCase
+import codecs
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
 from lxml import etree
 
+import t2r
 from t2r import TreeExtractor
 
 test_config = etree.parse("./test_t2r.xml")
@@ -20,3 +26,301 @@ class TestTreeExtractor(TestCase):
         extractor = TreeExtractor(test_config)
         res = extractor.extract_items(test_data)
         return res
+
+    def test_path_compiled_once(self):
+        config = etree.fromstring('<table><rows path="$.users[*]"><item field="Name" path="name"/></rows></table>')
+        extractor = TreeExtractor(config)
+        with mock.patch.object(t2r.jsonpath, "parse", side_effect=AssertionError("Path parsed at extraction.")):
+            res = extractor.extract_items([{"users": [{"name": "Mary"}]}])
+        assert res == [{"Name": "Mary"}]
+
+    def test_mapping_tree_node(self):
+        config = etree.fromstring('<table><rows path="$.a" optional="True" foo="bar"><item field="F"/></rows></table>')
+        rows = t2r.MappingTree.compile(config).children[0]
+        assert rows.optional is True and rows.path == "$.a" and rows.field == "value"
+        assert rows.has_attr("foo") and rows.get_attr("foo", None) == "bar" and not rows.has_attr("field")
+        assert rows.get_attr("field", "default") == "default" and rows.children[0].get_attr("field", None) == "F"
+        assert str(rows) == "rows(engine=jsonpath-ng, path=$.a, optional=True, foo=bar)"
+        assert not hasattr(rows, "__dict__")
+
+    def test_cache_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "config.xml")
+            with open(path, "w") as f:
+                f.write('<table><rows><item field="Name" path="name"/></rows></table>')
+            extractor = TreeExtractor(path)
+            assert TreeExtractor(path)._mapping is extractor._mapping
+            assert extractor.extract_items(test_data) == [{"Name": "Mary"}, {"Name": "Tom"}]
+            TreeExtractor.cache.invalidate(path)
+            assert TreeExtractor(path)._mapping is not extractor._mapping
+
+
+class TestSimpleJsonPath(TestCase):
+    """Parity between lowered simple paths and the full jsonpath-ng."""
+    paths = ["name", "$", "$.name", "$.a.b[0].c", "$.items[*].name", "$.items[*]", "$.items[1]", "$.items[-1]",
+             "$.items[5]", "$.items[0,2]", "$.items[1:]", "$.items[::2]", "$.*", "$.a.*", "$[0]", "$[*].name",
+             "$.a.b", "$.name[0]", "$.name[*]", "$.n[*]", "$.n[0]", "$.none.x", "$.none[*]", "$.a.b,c"]
+    data = [
+        {"name": "Mary", "n": 3, "none": None, "a": {"b": [{"c": 1}, {"c": 2}], "c": "x"},
+         "items": [{"name": "i0"}, {"name": None}, {"other": 1}, "str", 5]},
+        {"a": {"b": {"0": "dict, not list"}}, "items": {"name": "single"}},
+        {"a": [], "items": [], "name": ""},
+        [{"name": "l0"}, {"name": "l1"}],
+        "plain string",
+        0,
+        None,
+    ]
+    configs = {
+        "rows": '<rows path="$.items[*]" optional="True"><item field="v" path="name" optional="True"/></rows>',
+        "items": '<items path="$.a" optional="True"><item field="c" path="c" optional="True"/></items>',
+        "item": '<items><item field="v" path="$.a.c" optional="True"/></items>',
+        "itemAny": '<items><itemAny field="v" path="$.items[*]" optional="True">'
+                   '<item path="name" optional="True"/></itemAny></items>',
+        "itemAll": '<items><itemAll field="v" path="$.a.b[*].c" optional="True"/></items>',
+        "itemJoin": '<items><itemJoin field="v" path="$.items[*].name" delimiter="|" optional="True"/></items>',
+    }
+
+    def test_lowering(self):
+        engine = t2r.JsonEngine()
+        for path in ["name", "$.a.b[0].c", "$.items[*].name", "$.a.*"]:
+            assert isinstance(engine.compile(path), t2r.SimpleJsonPath), path
+        for path in ["$..name", "$.items[?(@.name)]", "$.a.`len`"]:
+            assert not isinstance(engine.compile(path), t2r.SimpleJsonPath), path
+
+    def test_engine_parity(self):
+        fast, full = t2r.JsonEngine(), t2r.JsonEngine(lower_simple_paths=False)
+        for path in self.paths:
+            fast_expr, full_expr = fast.compile(path), full.compile(path)
+            assert isinstance(fast_expr, t2r.SimpleJsonPath), path
+            for data in self.data:
+                self.assertEqual(self._result_of(lambda: fast.parse(data, fast_expr, None)),
+                                 self._result_of(lambda: full.parse(data, full_expr, None)),
+                                 f"path={path}, data={data}")
+
+    def test_tag_parity(self):
+        for tag, xml in self.configs.items():
+            fast = TreeExtractor(etree.fromstring(f'<table engine="json">{xml}</table>'))
+            full = TreeExtractor(etree.fromstring(f'<table engine="jsonpath">{xml}</table>'))
+            for data in self.data:
+                self.assertEqual(self._result_of(lambda: fast.extract_item(data)),
+                                 self._result_of(lambda: full.extract_item(data)), f"tag={tag}, data={data}")
+
+    @staticmethod
+    def _result_of(func):
+        try:
+            return func()
+        except Exception as e:
+            return type(e), str(e)
+
+
+class TestCompiledExtractor(TestCase):
+    """Parity between the generated extractor and the interpreter."""
+    configs = [
+        '<table><rows path="$.items[*]"><item field="Name" path="name"/><item field="N" path="n" optional="True"/>'
+        '</rows></table>',
+        '<table><rows path="$.items[*]" optional="True"><item field="Name" path="name" optional="True"/></rows>'
+        '<rows path="$.items[*]"/></table>',
+        '<table><rows><items path="$.a"><item field="c" path="c"/><itemAll field="b" path="b[*].c"/></items>'
+        '<itemAny field="any" path="$.items[*]"><item path="name" optional="True"/></itemAny>'
+        '<itemJoin field="join" path="$.items[*].name" delimiter=" | "/></rows></table>',
+        '<table><rows><items path="$.missing" optional="True"><item field="x" path="x" optional="True"/></items>'
+        '<itemAny field="leaf" path="$.items[*].name" optional="True"/>'
+        '<itemAll field="all" path="$.items[*]" optional="True"><item path="name" optional="True"/></itemAll>'
+        '<itemAll field="raw" path="$.items[*]" optional="True"/>'
+        '<itemJoin field="j" path="$.items[*]" optional="True"><item path="name" optional="True"/></itemJoin>'
+        '</rows></table>',
+        '<table><rows><item field="v" path="$.items[*].name"/></rows></table>',
+        '<table><rows><item field="v" path="$.a"/></rows></table>',
+        '<table><rows><itemJoin field="v" path="$.blank"/></rows></table>',
+        '<table><rows><unknown path="$.a"/></rows></table>',
+        '<table><rows/><rows/></table>',
+    ]
+    data = [
+        {"items": [{"name": "i0", "n": 1}, {"name": "i1"}], "a": {"c": "x", "b": [{"c": 1}, {"c": 2}]},
+         "blank": [" ", ""]},
+        {"items": [{"name": None}, {"name": "  "}], "a": {"c": None, "b": []}},
+        {"items": [], "a": None},
+        {},
+        None,
+    ]
+
+    def test_parity(self):
+        for xml in self.configs:
+            config = etree.fromstring(xml)
+            interpreted, compiled = TreeExtractor(config), TreeExtractor(config, compiled=True)
+            for data in self.data:
+                self.assertEqual(TestSimpleJsonPath._result_of(lambda: interpreted.extract_item(data)),
+                                 TestSimpleJsonPath._result_of(lambda: compiled.extract_item(data)),
+                                 f"config={xml}, data={data}")
+
+
+    def test_engine_subclass(self):
+        class Upper(t2r.JsonEngine):
+            def parse(self, data_node, path, conf_node):
+                return [x.upper() for x in super().parse(data_node, path, conf_node)]
+
+        with mock.patch.dict(t2r.MappingTree._MappingTree__name2engine, {"upper": Upper()}):
+            config = etree.fromstring('<table engine="upper"><rows><item field="Name" path="$.name"/></rows></table>')
+            interpreted, compiled = TreeExtractor(config), TreeExtractor(config, compiled=True)
+        assert interpreted.extract_item({"name": "mary"}) == compiled.extract_item({"name": "mary"}) == \
+               {"Name": "MARY"}
+
+
+class TestBatchExtraction(TestCase):
+    config = etree.fromstring('<table><rows><item field="Name" path="name"/></rows></table>')
+
+    def test_iter_extract(self):
+        extractor = TreeExtractor(self.config)
+        rows = extractor.iter_extract({"name": f"n{i}"} for i in range(3))
+        assert next(rows) == {"Name": "n0"}
+        assert list(rows) == [{"Name": "n1"}, {"Name": "n2"}]
+
+    def test_errors(self):
+        extractor = TreeExtractor(self.config)
+        items = [{"name": "Mary"}, {}, {"name": "Tom"}]
+        with self.assertRaises(t2r.ExtractionError) as ctx:
+            list(extractor.iter_extract(items))
+        assert ctx.exception.index == 1
+        rows = list(extractor.iter_extract(items, errors="yield"))
+        assert rows[0] == {"Name": "Mary"} and rows[2] == {"Name": "Tom"}
+        assert isinstance(rows[1], t2r.ExtractionError) and isinstance(rows[1].error, RuntimeError)
+
+    def test_processes(self):
+        items = [{"name": f"n{i}"} if i % 7 else {} for i in range(100)]
+        for compiled in (False, True):
+            extractor = TreeExtractor(self.config, compiled=compiled)
+            expected = list(extractor.iter_extract(items, errors="yield"))
+            rows = list(extractor.iter_extract(iter(items), processes=2, chunk_size=8, errors="yield"))
+            assert [type(x) for x in rows] == [type(x) for x in expected]
+            assert [x for x in rows if isinstance(x, dict)] == [x for x in expected if isinstance(x, dict)]
+            assert [x.index for x in rows if isinstance(x, t2r.ExtractionError)] == list(range(0, 100, 7))
+        valid = [x for x in items if x]
+        assert extractor.extract_items(valid, processes=2, chunk_size=8) == extractor.extract_items(valid)
+        for processes in (0, 2):
+            with self.assertRaises(RuntimeError) as ctx:  # The original error.
+                extractor.extract_items(items, processes=processes)
+            assert not isinstance(ctx.exception, t2r.ExtractionError)
+        for kwargs in ({"processes": 2, "chunk_size": 0}, {"processes": -1}):
+            with self.assertRaises(ValueError):
+                extractor.extract_items(valid, **kwargs)
+            with self.assertRaises(ValueError):
+                next(extractor.iter_extract(valid, **kwargs))
+
+    def test_extract_columns(self):
+        config = etree.fromstring('<table><rows><item field="n" path="n" optional="True"/>'
+                                  '<item field="x" path="x" optional="True"/><item field="s" path="s" optional="True"/>'
+                                  '</rows></table>')
+        items = [{"n": 1, "x": 0.5}, {"n": 2, "x": None, "s": "a"}, {"n": 3, "x": 1}]
+        extractor = TreeExtractor(config, compiled=True)
+        columns = extractor.extract_columns(items)
+        rows = extractor.extract_items(items)
+        assert list(columns) == ["n", "x", "s"]
+        assert columns["n"].typecode == "q" and list(columns["n"]) == [1, 2, 3]
+        for field, column in columns.items():
+            assert list(column) == [row.get(field) for row in rows]
+        assert columns["x"] == [0.5, None, 1] and columns["s"] == [None, "a", None]
+        records = extractor.extract_records(items)
+        assert records.n.dtype.kind == "i" and list(records.n) == [1, 2, 3]
+        assert list(records.s) == [None, "a", None]
+
+    def test_iter_json_records(self):
+        records = [{"name": "Mary", "n": 123456}, [1, 2.5, None], "sé", 0, {"nested": {"a": [{}, []]}}]
+        text = " \n [" + " , ".join(json.dumps(x, ensure_ascii=False) for x in records) + "] \n"
+        for buffer_size in (1, 3, 1 << 16):
+            assert list(t2r.iter_json_records(io.BytesIO(text.encode()), buffer_size=buffer_size)) == records
+        assert list(t2r.iter_json_records(io.BytesIO(b"[]"))) == []
+        lines = "\n".join(json.dumps(x) for x in records) + "\n\n"
+        assert list(t2r.iter_json_records(io.BytesIO(lines.encode()))) == records
+        with self.assertRaises(ValueError):
+            list(t2r.iter_json_records(io.BytesIO(b'[{"a": 1} {"a": 2}]'), buffer_size=2))
+        numbers = b'[12.5, 1e5, -3, 0.25E-2 ,7.0e+10 , 123456789]'
+        for buffer_size in range(1, len(numbers) + 2):  # Numbers cut by every buffer boundary.
+            assert list(t2r.iter_json_records(io.BytesIO(numbers), buffer_size=buffer_size)) == json.loads(numbers)
+        assert list(t2r.iter_json_records(io.BytesIO(codecs.BOM_UTF8 + b'[1, 2]'))) == [1, 2]
+        assert list(t2r.iter_json_records(io.BytesIO(codecs.BOM_UTF8 + b'{"a": 1}\n'))) == [{"a": 1}]
+
+    def test_extract_json2file(self):
+        extractor = TreeExtractor(self.config)
+        source = io.BytesIO(b'[{"name": "Mary"}, {"name": "Tom"}]')
+        sink = io.StringIO()
+        assert extractor.extract_json2file(source, sink, "csv") == 2
+        assert sink.getvalue().splitlines() == ["Name", "Mary", "Tom"]
+        source = io.BytesIO(b'{"name": "Mary"}\n{"name": "Tom"}\n')
+        sink = io.StringIO()
+        extractor.extract_json2file(source, sink)
+        assert [json.loads(x) for x in sink.getvalue().splitlines()] == [{"Name": "Mary"}, {"Name": "Tom"}]
+        config = etree.fromstring('<table><rows><item field="Name" path="name"/>'
+                                  '<rows path="$.pets[*]" optional="True"><item field="Pet" path="name"/></rows>'
+                                  '</rows></table>')
+        extractor = TreeExtractor(config)
+        assert extractor.fields() == ["Name", "Pet"]  # 'Pet' of the optional 'rows' only.
+        source = b'{"name": "Mary"}\n{"name": "Tom", "pets": [{"name": "Kitty"}]}\n'
+        sink = io.StringIO()
+        assert extractor.extract_json2file(io.BytesIO(source), sink, "csv") == 2
+        assert sink.getvalue().splitlines() == ["Name,Pet", "Mary,", "Tom,Kitty"]
+        sink = io.StringIO()
+        extractor.extract_json2file(io.BytesIO(source), sink, "csv", fieldnames=["Pet", "Name"])
+        assert sink.getvalue().splitlines() == ["Pet,Name", ",Mary", "Kitty,Tom"]
+
+    def test_parse_batch(self):
+        nodes = [mock.Mock(spec=["name"]), mock.Mock(spec=[]), {"name": "d"}, {"x": 1}]
+        nodes[0].name = "n0"
+        for engine, path in ((t2r.ObjectEngine(), "name"), (t2r.JsonEngine(), "name"),
+                             (t2r.JsonEngine(lower_simple_paths=False), "$.name")):
+            expr = engine.compile(path)
+            assert engine.parse_batch(nodes, expr, None) == [engine.parse(x, expr, None) for x in nodes]
+        config = etree.fromstring('<table><rows path="$.rows[*]"><item field="Name" path="name" engine="object"/>'
+                                  '</rows></table>')
+        items = [{"rows": nodes[:1]}, {"rows": [None, nodes[0], None]}, {"rows": nodes[:2]}]
+        for compiled in (False, True):
+            extractor = TreeExtractor(config, compiled=compiled)
+            assert extractor.extract_item(items[0]) == {"Name": "n0"}
+            with mock.patch.object(t2r.ObjectEngine, "parse", side_effect=AssertionError("Parsed one by one.")):
+                with self.assertRaisesRegex(RuntimeError, "Input data for non-optional 'item'"):
+                    extractor.extract_item(items[1])
+                with self.assertRaisesRegex(RuntimeError, "Non-optional 'item' should extract 1 data item"):
+                    extractor.extract_item(items[2])
+
+    def test_cache(self):
+        cache = t2r.MappingTreeCache(max_size=2)
+        xml = '<table><rows><item field="Name" path="name"/></rows></table>'
+        mapping, func = cache.get(etree.fromstring(xml))
+        assert func is None and (cache.hits, cache.misses) == (0, 1)
+        same, func = cache.get(etree.fromstring(xml.replace("<rows>", "<rows><!-- Comment. -->")), compiled=True)
+        assert same is mapping and func is not None and (cache.hits, cache.misses) == (1, 1)
+        cache.get(etree.fromstring(xml.replace("Name", "Other")))
+        cache.get(etree.fromstring(xml.replace("Name", "Third")))
+        assert len(cache) == 2
+        assert cache.get(etree.fromstring(xml))[0] is not mapping  # Evicted.
+        cache.invalidate(etree.fromstring(xml))
+        assert len(cache) == 1
+        cache.invalidate()
+        assert len(cache) == 0
+
+    def test_memo(self):
+        shop = {"name": "s", "tags": ["a", "b"], "addr": {"c": "x", "b": [{"c": 1}]}}
+        items = [{"id": i, "shop": shop} for i in range(5)]
+        config = etree.fromstring(
+            '<table><rows><item field="id" path="id"/><items path="$.shop"><item field="shop" path="name"/>'
+            '<itemAll field="tags" path="tags[*]"/><itemJoin field="join" path="tags[*]"/>'
+            '<items path="addr"><item field="c" path="c"/><itemAll field="b" path="b[*].c"/></items>'
+            '</items></rows></table>')
+        for compiled in (False, True):
+            extractor = TreeExtractor(config, compiled=compiled)
+            expected = extractor.extract_items(items)
+            for memo in ("id", "content"):
+                rows = extractor.extract_items(items, memo=memo)
+                assert rows == expected
+                assert rows[0]["tags"] is not rows[1]["tags"]
+            for memo in (t2r.SubtreeMemo(), t2r.SubtreeMemo(by_content=True)):
+                for item in items:
+                    extractor.extract_item(item, memo)
+                # Subtrees on each item miss, the 3 on the shared shop hit after the first item.
+                assert (memo.hits, memo.misses) == (4 * 3, 5 + 3 + 1)
+            memo = t2r.SubtreeMemo(by_content=True)
+            for item in json.loads(json.dumps(items)):  # Equal shops of different identities.
+                extractor.extract_item(item, memo)
+            assert memo.hits == 4 * 3
+            assert all(len(x[1]) == 16 and y[0] is None for x, y in memo._key2entry.items())  # Digests only.
+            surrogates = json.loads(json.dumps([{"id": 0, "shop": {**shop, "name": "\ud800"}}] * 2))
+            assert extractor.extract_items(surrogates, memo="content") == extractor.extract_items(surrogates)